@@ -0,0 +1,125 @@
+"""
+This file contains the refresh logic of the analytics summary tables (store_price_stats,
+price_histogram and tag_pairs). The summaries are rebuilt with aggregate SQL one store at a
+time, and only for the stores the outbox says changed since the last refresh, so reading a
+report never scans the whole catalog
+"""
+
+import math
+import threading
+from collections import defaultdict
+
+from sqlalchemy import Integer, cast, func, insert, literal, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+
+from events import settled
+from models import (AnalyticsCursorModel, ItemModel, ItemTags, OutboxEventModel,
+                    PriceHistogramModel, StoreModel, StorePriceStatsModel, TagPairModel)
+
+PERCENTILES = (50, 90, 99)
+
+# Two refreshes of the same database in one process would only redo each other's work
+_refresh_locks = defaultdict(threading.Lock)
+
+
+def _rebuild_store(session, store_id: int, bucket_width: float):
+    for model in (StorePriceStatsModel, PriceHistogramModel, TagPairModel):
+        session.query(model).filter(model.store_id == store_id).delete()
+
+    in_store = ItemModel.store_id == store_id
+    count, price_min, price_max, price_avg = session.query(
+        func.count(ItemModel.id), func.min(ItemModel.price), func.max(ItemModel.price),
+        func.avg(ItemModel.price),
+    ).filter(in_store).one()
+
+    if not count:
+        return
+
+    # Nearest-rank percentiles, read off the (store_id, price) index without sorting
+    percentiles = {
+        f"p{percentile}": session.query(ItemModel.price).filter(in_store)
+        .order_by(ItemModel.price).offset(math.ceil(percentile / 100 * count) - 1).limit(1)
+        .scalar()
+        for percentile in PERCENTILES
+    }
+    session.add(StorePriceStatsModel(store_id=store_id, item_count=count, price_min=price_min,
+                                     price_max=price_max, price_avg=price_avg, **percentiles))
+
+    bucket = cast(ItemModel.price / bucket_width, Integer)
+    session.execute(insert(PriceHistogramModel).from_select(
+        ["store_id", "bucket", "item_count"],
+        select(literal(store_id), bucket, func.count()).where(in_store).group_by(bucket),
+    ))
+
+    tag_a, tag_b = aliased(ItemTags), aliased(ItemTags)
+    session.execute(insert(TagPairModel).from_select(
+        ["store_id", "tag_a", "tag_b", "item_count"],
+        select(literal(store_id), tag_a.tag_id, tag_b.tag_id,
+               func.count(func.distinct(tag_a.item_id)))
+        .join(tag_b, (tag_a.item_id == tag_b.item_id) & (tag_a.tag_id < tag_b.tag_id))
+        .join(ItemModel, ItemModel.id == tag_a.item_id)
+        .where(in_store)
+        .group_by(tag_a.tag_id, tag_b.tag_id),
+    ))
+
+
+def _changed_stores(events) -> set:
+    stores = set()
+    for event in events:
+        if event["entity"] == StoreModel.__tablename__:
+            stores.add(event["entity_id"])
+        elif event["entity"] == ItemModel.__tablename__:
+            stores.add(event["payload"]["store_id"])
+    return stores
+
+
+def refresh(session, bucket_width: float, commit_lag: float, full: bool = False) -> int:
+    """ Brings the summary tables of one database up to date with its outbox
+
+    Args:
+        session (Session): The session of the database (the main one or a shard)
+        bucket_width (float): The price range covered by each histogram bucket
+        commit_lag (float): EVENTS_COMMIT_LAG, read by the caller since shard threads have no
+            app context
+        full (bool, optional): Rebuild every store instead of only the ones that changed
+
+    Returns:
+        int: The number of stores that were rebuilt
+    """
+    with _refresh_locks[session.get_bind()]:
+        cursor = session.get(AnalyticsCursorModel, 1)
+        if cursor is None:
+            cursor = AnalyticsCursorModel(id=1, last_event_id=0)
+            session.add(cursor)
+            full = True
+
+        # The cursor only moves past settled events, one committed later with a lower id would
+        # otherwise never be summarized
+        events = settled([dict(row._mapping) for row in session.query(
+            OutboxEventModel.id, OutboxEventModel.created_at, OutboxEventModel.entity,
+            OutboxEventModel.entity_id, OutboxEventModel.payload,
+        ).filter(OutboxEventModel.id > cursor.last_event_id).order_by(OutboxEventModel.id)],
+            cursor.last_event_id, commit_lag)
+
+        if full:
+            stores = {store_id for store_id, in session.query(StoreModel.id)}
+            stores |= {store_id for store_id, in session.query(StorePriceStatsModel.store_id)}
+        else:
+            if not events:
+                return 0
+
+            stores = _changed_stores(events)
+
+        for store_id in stores:
+            _rebuild_store(session, store_id, bucket_width)
+        if events:
+            cursor.last_event_id = events[-1]["id"]
+
+        try:
+            session.commit()
+        except IntegrityError:
+            # Another worker refreshed the same stores first, its summaries are just as fresh
+            session.rollback()
+
+        return len(stores)
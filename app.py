@@ -11,13 +11,28 @@ from flask_migrate import Migrate
 
 from db import db
 from blocklist import BLOCKLIST
+from sharding import init_sharding, close_sharding
+from group_commit import init_group_commit, close_group_commit
+from events import init_events, close_events
 import models
 
 from resources.item import blp as ItemBlueprint
 from resources.store import blp as StoreBlueprint
 from resources.tag import blp as TagBlueprint
 from resources.user import blp as UserBlueprint
-from flask_jwt_extended import JWTManager
+from resources.price import blp as PriceBlueprint
+from resources.event import blp as EventBlueprint
+from resources.analytics import blp as AnalyticsBlueprint
+from resources.metrics import blp as MetricsBlueprint
+from jwt_keys import CachingJWTManager, init_signing_keys
+from entity_cache import init_entity_cache, close_entity_cache
+from deadlines import init_deadlines, parse_route_limits
+from sqlite_tuning import init_sqlite_tuning
+from seed import seed_command
+from payloads import init_payload_limits
+from memory_profile import init_memory_profile
+from shared_state import init_shared_state
+from rate_limits import init_rate_limits
 
 def create_app(db_url:str=None) -> Flask:
     """_summary_
@@ -38,14 +53,113 @@ def create_app(db_url:str=None) -> Flask:
     app.config["OPENAPI_SWAGGER_UI_PATH"] = "/swagger-ui"
     app.config["OPENAPI_SWAGGER_UI_URL"] = "https://cdn.jsdelivr.net/npm/swagger-ui-dist/"
     app.config["SQLALCHEMY_DATABASE_URI"] = db_url or os.getenv("DATABASE_URL", "sqlite:///data.db")
+    # "multi" when several workers (processes or containers) serve the same database: state
+    # they must agree on is kept in the database and JWT_SECRET_KEY must come from the environment
+    app.config["DEPLOYMENT_MODE"] = os.getenv("DEPLOYMENT_MODE", "single")
+    multi_process = app.config["DEPLOYMENT_MODE"] == "multi"
+    # Where revoked tokens and rate limit counters are kept, "memory" or "database"
+    app.config["SHARED_STATE_BACKEND"] = os.getenv(
+        "SHARED_STATE_BACKEND", "database" if multi_process else "memory")
+    # Requests per client allowed in each window, per endpoint, e.g. "Users.UserLogin=10"
+    app.config["RATE_LIMITS"] = parse_route_limits(os.getenv("RATE_LIMITS", ""), int)
+    app.config["RATE_LIMIT_WINDOW"] = int(os.getenv("RATE_LIMIT_WINDOW", "60"))
+    # Reverse proxies in front of the workers whose X-Forwarded-For and X-Forwarded-Proto are
+    # trusted. Leave it at 0 when clients connect directly, or they could pick their own address
+    app.config["PROXY_COUNT"] = int(os.getenv("PROXY_COUNT", "0"))
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # Comma separated list of database URLs that stores, items and tags are spread across. Every
+    # create still commits its id to the main database's shard directory first, so sharding
+    # spreads reads but not the cost of creating rows, see sharding.py
+    app.config["SHARD_DATABASE_URLS"] = [
+        url for url in os.getenv("SHARD_DATABASE_URLS", "").split(",") if url
+    ]
+    # Set to a few milliseconds to commit concurrent writes together, 0 commits every write alone
+    app.config["GROUP_COMMIT_WINDOW_MS"] = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "0"))
+    app.config["GROUP_COMMIT_MAX_BATCH"] = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "256"))
+    # Largest number of ids accepted by the /<resource>/batch endpoints
+    app.config["BATCH_MAX_IDS"] = int(os.getenv("BATCH_MAX_IDS", "500"))
+    # Price range covered by each bucket of the analytics price histograms
+    app.config["ANALYTICS_HISTOGRAM_WIDTH"] = float(os.getenv("ANALYTICS_HISTOGRAM_WIDTH", "10"))
+    # Change events are read from the outbox by one thread and buffered for /events subscribers
+    app.config["EVENTS_POLL_INTERVAL"] = float(os.getenv("EVENTS_POLL_INTERVAL", "0.2"))
+    app.config["EVENTS_BUFFER_SIZE"] = int(os.getenv("EVENTS_BUFFER_SIZE", "10000"))
+    app.config["EVENTS_HEARTBEAT"] = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+    # Longest a transaction may take between adding its event and committing, events after a
+    # gap in the ids are held back that long in case the missing ones are still being committed
+    app.config["EVENTS_COMMIT_LAG"] = float(os.getenv("EVENTS_COMMIT_LAG", "5"))
+    # Seconds events are kept after every reader is done with them, 0 keeps them forever. Other
+    # workers and clients resuming with Last-Event-ID must catch up within it
+    app.config["EVENTS_RETENTION"] = float(os.getenv("EVENTS_RETENTION", str(24 * 3600)))
+    app.config["EVENTS_PRUNE_INTERVAL"] = float(os.getenv("EVENTS_PRUNE_INTERVAL", "60"))
+    # Rows looked up by id are cached as snapshots, 0 turns the cache off
+    app.config["ENTITY_CACHE_SIZE"] = int(os.getenv("ENTITY_CACHE_SIZE", "10000"))
+    app.config["ENTITY_CACHE_TTL"] = float(os.getenv("ENTITY_CACHE_TTL", "60"))
+    # Seconds a request may run before its SQL is cancelled and it gets a 504, 0 means no limit.
+    # REQUEST_TIMEOUTS overrides it per endpoint, e.g. "stores.StoreList=5,Items.ItemList=5"
+    app.config["REQUEST_TIMEOUT"] = float(os.getenv("REQUEST_TIMEOUT", "30"))
+    app.config["REQUEST_TIMEOUTS"] = {
+        # An import can be as large as its body limit and commits batch by batch as it goes, so
+        # cutting it off at some point would only leave it half done
+        "Items.ItemBulk": 0,
+        **parse_route_limits(os.getenv("REQUEST_TIMEOUTS", ""), float),
+    }
+    # Most requests an endpoint serves at once in each worker process before answering 503,
+    # e.g. "stores.StoreList=4". The deployment serves that many times the number of workers
+    app.config["REQUEST_CONCURRENCY"] = parse_route_limits(
+        os.getenv("REQUEST_CONCURRENCY", ""), int)
+    # Largest request body accepted, REQUEST_BODY_LIMITS overrides it per endpoint, e.g.
+    # "Items.ItemBulk=268435456". The bulk import reads its body as a stream so it can be larger
+    app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_CONTENT_LENGTH", str(1024 * 1024)))
+    app.config["REQUEST_BODY_LIMITS"] = {
+        "Items.ItemBulk": 256 * 1024 * 1024,
+        **parse_route_limits(os.getenv("REQUEST_BODY_LIMITS", ""), int),
+    }
+    # Items written per transaction by /item/bulk, and the largest item it accepts in characters
+    app.config["BULK_BATCH_SIZE"] = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+    app.config["BULK_MAX_ELEMENT_SIZE"] = int(os.getenv("BULK_MAX_ELEMENT_SIZE", str(64 * 1024)))
+    # Share of requests whose peak allocation is traced with tracemalloc, 0 turns it off
+    app.config["MEMORY_PROFILE_RATE"] = float(os.getenv("MEMORY_PROFILE_RATE", "0"))
+    # Applied to every new SQLite connection, negative cache_size is in KiB
+    app.config["SQLITE_PRAGMAS"] = {
+        "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),
+        "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+        "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+        "foreign_keys": os.getenv("SQLITE_FOREIGN_KEYS", "ON"),
+    }
+    # Parsed statements kept per SQLite connection
+    app.config["SQLITE_STATEMENT_CACHE_SIZE"] = int(os.getenv("SQLITE_STATEMENT_CACHE_SIZE", "256"))
+    init_sqlite_tuning(app)
     db.init_app(app)
     migrate = Migrate(app, db)
+    init_sharding(app)
+    init_group_commit(app)
+    init_events(app)
+    init_entity_cache(app)
+    init_deadlines(app)
+    init_payload_limits(app)
+    init_memory_profile(app)
+    init_shared_state(app)
+    init_rate_limits(app)
+
+    app.cli.add_command(seed_command)
 
     api = Api(app)
 
-    app.config["JWT_SECRET_KEY"] = "236520528094713753437932268324630142015"
-    jwt = JWTManager(app)
+    app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
+    # Set JWT_ALGORITHM to RS256 or EdDSA to sign with the key files below instead of the secret
+    app.config["JWT_ALGORITHM"] = os.getenv("JWT_ALGORITHM", "HS256")
+    if not app.config["JWT_SECRET_KEY"] and app.config["JWT_ALGORITHM"].startswith("HS"):
+        if multi_process:
+            raise RuntimeError("JWT_SECRET_KEY must be set when DEPLOYMENT_MODE is multi, "
+                               "or every worker would sign tokens with its own key.")
+        app.config["JWT_SECRET_KEY"] = "236520528094713753437932268324630142015"
+    app.config["JWT_KEY_ID"] = os.getenv("JWT_KEY_ID")
+    app.config["JWT_PRIVATE_KEY_FILE"] = os.getenv("JWT_PRIVATE_KEY_FILE")
+    app.config["JWT_PUBLIC_KEYS_DIR"] = os.getenv("JWT_PUBLIC_KEYS_DIR")
+    # How many verified tokens are remembered so their signatures aren't checked again
+    app.config["JWT_VERIFIED_CACHE_SIZE"] = int(os.getenv("JWT_VERIFIED_CACHE_SIZE", "4096"))
+    jwt = CachingJWTManager(app, cache_size=app.config["JWT_VERIFIED_CACHE_SIZE"])
+    init_signing_keys(app, jwt)
 
     @jwt.token_in_blocklist_loader
     def check_if_token_in_blocklist(jwt_header, jwt_payload):
@@ -127,6 +241,28 @@ def create_app(db_url:str=None) -> Flask:
     api.register_blueprint(StoreBlueprint)
     api.register_blueprint(TagBlueprint)
     api.register_blueprint(UserBlueprint)
+    api.register_blueprint(PriceBlueprint)
+    api.register_blueprint(EventBlueprint)
+    api.register_blueprint(AnalyticsBlueprint)
+    api.register_blueprint(MetricsBlueprint)
 
     return app
-        
\ No newline at end of file
+        
+
+
+def dispose_app(app: Flask):
+    """ Stops the app's background threads and closes its database connections, for apps made
+        for a single run, like the ones serving a SeedSnapshot clone. The app can't serve
+        requests afterwards
+
+    Args:
+        app (Flask): An application made by create_app
+    """
+    # The tailer goes first, the entity cache's watcher ends with its subscription
+    close_events(app)
+    close_entity_cache(app)
+    close_group_commit(app)
+    close_sharding(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
@@ -3,6 +3,34 @@ This file just contains the blocklist of the JWT tokens. It will be imported by
 the logout resource so that tokens can be added to the blocklist when the user logs out
 """
 
-# Normally would use a DB since resetting the app will clear out this set
-# and previously revoked JWTs would be valid again
-BLOCKLIST = set()
+import time
+
+from shared_state import get_shared_state
+
+
+class Blocklist:
+    """ Set of revoked token ids kept in the app's shared state backend, so a token revoked
+        by one worker is refused by all of them, and with the database backend it stays
+        revoked across restarts
+    """
+
+    # How long a revoked token is remembered when its expiry isn't given
+    default_ttl = 30 * 24 * 3600
+
+    def add(self, jti: str, expires_at: int = None):
+        """ Revokes a token
+
+        Args:
+            jti (str): The id of the token
+            expires_at (int, optional): The token's exp claim, it doesn't need to be
+                remembered past it
+        """
+        if expires_at is None:
+            expires_at = int(time.time()) + self.default_ttl
+        get_shared_state().add("blocklist", jti, expires_at)
+
+    def __contains__(self, jti: str) -> bool:
+        return get_shared_state().contains("blocklist", jti)
+
+
+BLOCKLIST = Blocklist()
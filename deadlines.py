@@ -0,0 +1,244 @@
+"""
+This file contains the per-route request deadlines. Each request gets a deadline when it starts
+and every SQL statement it runs is cut off once the deadline passes: SQLite connections check it
+from a progress handler and Postgres transactions get a matching statement_timeout. Requests
+that run out of time get a 504, and routes with a concurrency limit answer 503 when it's full.
+Streamed responses keep both until they've been sent. The concurrency limits are per worker
+process, while the timeout and rejection counts are kept in the shared state backend so
+GET /metrics reports the whole deployment's
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+from shared_state import FOREVER, get_shared_state
+
+# How many SQLite VM instructions run between two deadline checks
+PROGRESS_INTERVAL = 10000
+
+_local = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    """ Raised when work done for a request outlives the request's deadline """
+
+
+def remaining() -> float:
+    """ Returns the seconds left before the current request's deadline, None without one """
+    deadline = getattr(_local, "deadline", None)
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def with_deadline(func):
+    """ Wraps func so it runs under the calling request's deadline from another thread
+
+    Args:
+        func: The callable to hand to a worker thread
+
+    Returns:
+        The wrapped callable
+    """
+    deadline = getattr(_local, "deadline", None)
+
+    def run(*args, **kwargs):
+        _local.deadline = deadline
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.deadline = None
+
+    return run
+
+
+def iter_with_deadline(iterable):
+    """ Wraps an iterator that is consumed after the request's view returned, like the body of
+        a streamed response, so every step runs under the request's deadline
+
+    Args:
+        iterable: The iterable to consume
+
+    Yields:
+        The items of iterable, raises DeadlineExceeded once the deadline has passed
+    """
+    deadline = getattr(_local, "deadline", None)
+    iterator = iter(iterable)
+
+    while True:
+        previous, _local.deadline = getattr(_local, "deadline", None), deadline
+        try:
+            if deadline is not None and deadline <= time.monotonic():
+                raise DeadlineExceeded("The request's deadline passed while it was being sent.")
+            item = next(iterator)
+        except StopIteration:
+            return
+        except OperationalError as error:
+            left = remaining()
+            if left is None or left > 0:
+                raise
+            raise DeadlineExceeded("A query was cut off by the request's deadline.") from error
+        finally:
+            _local.deadline = previous
+        yield item
+
+
+@contextmanager
+def no_deadline():
+    """ Lifts the current request's deadline for the block, for bookkeeping writes that have to
+        happen even when the request is out of time
+    """
+    previous, _local.deadline = getattr(_local, "deadline", None), None
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def raise_if_timed_out(error: Exception):
+    """ Raises DeadlineExceeded when error was caused by the request running out of time, so a
+        view that answers database errors with a 500 answers this one with a 504
+
+    Args:
+        error (Exception): The error caught around the request's database work
+    """
+    if isinstance(error, DeadlineExceeded):
+        raise error
+    left = remaining()
+    if isinstance(error, OperationalError) and left is not None and left <= 0:
+        raise DeadlineExceeded("A query was cut off by the request's deadline.") from error
+
+
+def record_overload(outcome: str):
+    """ Counts a timed out or rejected request of the current endpoint for GET /metrics
+
+    Args:
+        outcome (str): "timed_out", "rejected" or "rate_limited"
+    """
+    # The request may be out of time already, which would cut the count's own write off
+    with no_deadline():
+        get_shared_state().incr("overload", f"{request.endpoint}.{outcome}", FOREVER)
+
+
+def overload_report() -> dict:
+    """ Returns the number of requests timed out, rejected or rate limited by every worker
+
+    Returns:
+        dict: The count per endpoint and outcome, e.g. {"Items.ItemList.timed_out": 2}
+    """
+    return get_shared_state().counters("overload")
+
+
+def _check_deadline() -> int:
+    # Called by SQLite while a statement runs, a non-zero return interrupts it
+    left = remaining()
+    return 1 if left is not None and left <= 0 else 0
+
+
+def _on_connect(dbapi_connection, connection_record):
+    if hasattr(dbapi_connection, "set_progress_handler"):
+        dbapi_connection.set_progress_handler(_check_deadline, PROGRESS_INTERVAL)
+
+
+def _on_begin(connection):
+    left = remaining()
+    if left is not None and connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {max(int(left * 1000), 1)}")
+
+
+def _start_request():
+    endpoint = request.endpoint
+    limits = current_app.extensions["deadlines"]
+
+    semaphore = limits.get(endpoint)
+    if semaphore is not None:
+        if not semaphore.acquire(blocking=False):
+            record_overload("rejected")
+            response = jsonify({"code": 503, "status": "Service Unavailable",
+                                "message": "Too many requests for this resource, try again."})
+            response.headers["Retry-After"] = "1"
+            return response, 503
+        g.deadline_semaphore = semaphore
+
+    timeout = current_app.config["REQUEST_TIMEOUTS"].get(endpoint,
+                                                         current_app.config["REQUEST_TIMEOUT"])
+    _local.deadline = time.monotonic() + timeout if timeout else None
+    return None
+
+
+def _hold_for_stream(response):
+    # A streamed response is produced after the request ends, the route's slot is only given
+    # back once it has been sent
+    semaphore = g.pop("deadline_semaphore", None)
+    if semaphore is not None:
+        if response.is_streamed:
+            response.call_on_close(semaphore.release)
+        else:
+            semaphore.release()
+    return response
+
+
+def _end_request(exc):
+    _local.deadline = None
+    # Only still set when the request failed before after_request ran
+    semaphore = g.pop("deadline_semaphore", None)
+    if semaphore is not None:
+        semaphore.release()
+
+
+def _timed_out():
+    record_overload("timed_out")
+    return jsonify({"code": 504, "status": "Gateway Timeout",
+                    "message": "The request took too long and was cancelled."}), 504
+
+
+def _handle_operational_error(error):
+    left = remaining()
+    if left is None or left > 0:
+        raise error
+    return _timed_out()
+
+
+def _handle_deadline_exceeded(error):
+    return _timed_out()
+
+
+def init_deadlines(app):
+    """ Registers the request deadline and concurrency limit hooks
+
+    Args:
+        app (Flask): The application holding REQUEST_TIMEOUT, REQUEST_TIMEOUTS and
+            REQUEST_CONCURRENCY
+    """
+    # Each worker process gets its own slots, the deployment serves limit times the workers
+    app.extensions["deadlines"] = {
+        endpoint: threading.BoundedSemaphore(limit)
+        for endpoint, limit in app.config["REQUEST_CONCURRENCY"].items()
+    }
+    app.before_request(_start_request)
+    app.after_request(_hold_for_stream)
+    app.teardown_request(_end_request)
+    app.register_error_handler(OperationalError, _handle_operational_error)
+    app.register_error_handler(DeadlineExceeded, _handle_deadline_exceeded)
+
+    if not event.contains(Engine, "connect", _on_connect):
+        event.listen(Engine, "connect", _on_connect)
+        event.listen(Engine, "begin", _on_begin)
+
+
+def parse_route_limits(value: str, cast) -> dict:
+    """ Parses settings like "stores.StoreList=5,Items.ItemList=10" into a dict
+
+    Args:
+        value (str): Comma separated endpoint=value pairs
+        cast: The type to convert each value to
+
+    Returns:
+        dict: The value per endpoint
+    """
+    pairs = (part.split("=", 1) for part in value.split(",") if part)
+    return {endpoint.strip(): cast(limit) for endpoint, limit in pairs}
@@ -0,0 +1,234 @@
+"""
+This file contains the in-process cache of rows looked up by primary key. Rows are kept as
+namedtuple snapshots of their columns (not ORM instances), in a size-bounded LRU. Entries are
+dropped when a session commits a change to them, and changes made by other workers are picked
+up from the outbox event stream, with ENTITY_CACHE_TTL as a backstop for tables without events
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import current_app
+from flask_smorest import abort
+from sqlalchemy import bindparam, event, inspect, select
+from sqlalchemy.orm import Session
+
+from events import get_tailer
+from models import StoreModel
+
+
+# Tables whose changes are recorded in the outbox, so other workers hear about them
+OUTBOX_TABLES = ("stores", "items", "tags")
+
+
+class EntityCache:
+    """ LRU of (table, primary key) -> (snapshot, time it was loaded) """
+
+    def __init__(self, max_size: int, ttl: float, tables=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        # The names of the tables that may be cached, None caches every table
+        self.tables = tables
+        self._entries = OrderedDict()
+        self._snapshot_types = {}
+        self._statements = {}
+        self._lock = threading.Lock()
+        # Bumped on every invalidation, a load that started before one isn't cached since it
+        # may have read the row just before the change was committed
+        self._generation = 0
+        self._watching = False
+
+    def _snapshot_type(self, table):
+        if table.name not in self._snapshot_types:
+            self._snapshot_types[table.name] = namedtuple(
+                f"{table.name}_snapshot", [column.name for column in table.columns])
+        return self._snapshot_types[table.name]
+
+    def _statement(self, model):
+        # Built once per table and reused, so every lookup hits SQLAlchemy's compiled cache
+        # and sqlite3's statement cache without rebuilding the SELECT
+        table = model.__table__
+        if table.name not in self._statements:
+            self._statements[table.name] = select(*table.columns).where(
+                inspect(model).primary_key[0] == bindparam("ident"))
+        return self._statements[table.name]
+
+    def get(self, session: Session, model, ident: int):
+        """ Returns a snapshot of the row, loading it with a single column SELECT on a miss
+
+        Args:
+            session (Session): The session of the database holding the row
+            model: The model class of the row
+            ident (int): The primary key of the row
+
+        Returns:
+            namedtuple: The row's column values, or None if it doesn't exist
+        """
+        table = model.__table__
+        key = (table.name, ident)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                return entry[0]
+            generation = self._generation
+
+        row = session.execute(self._statement(model), {"ident": ident}).first()
+        if row is None:
+            return None
+
+        snapshot = self._snapshot_type(table)(*row)
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (snapshot, time.monotonic())
+                if len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+        return snapshot
+
+    def invalidate(self, keys):
+        """ Drops the given (table name, primary key) entries
+
+        Args:
+            keys: Iterable of (table name, primary key) tuples
+        """
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def invalidate_store(self, store_id: int):
+        """ Drops a store and every entry that belongs to it
+
+        Args:
+            store_id (int): The id of the store
+        """
+        with self._lock:
+            self._generation += 1
+            stale = [key for key, (snapshot, _) in self._entries.items()
+                     if key == (StoreModel.__tablename__, store_id)
+                     # tags.store_id is a string column
+                     or str(getattr(snapshot, "store_id", None)) == str(store_id)]
+            for key in stale:
+                del self._entries[key]
+
+    def watch_outbox(self, tailer):
+        """ Starts a thread that drops entries changed by other workers as their events arrive
+
+        Args:
+            tailer (OutboxTailer): The tailer of the app's outbox
+        """
+        with self._lock:
+            if self._watching:
+                return
+            self._watching = True
+
+        # The starting offsets are taken now, before the caller's first lookup, so a change
+        # committed while the thread starts isn't missed
+        tailer.start()
+        subscription = tailer.subscribe(dict(tailer.offsets), heartbeat=60)
+
+        def watch():
+            for update in subscription:
+                if update is None:
+                    continue
+                _, change = update
+                if change["entity"] == StoreModel.__tablename__ and change["action"] == "deleted":
+                    # A store's items are deleted along with it, under the store's event only
+                    self.invalidate_store(change["entity_id"])
+                else:
+                    self.invalidate([(change["entity"], change["entity_id"])])
+
+        threading.Thread(target=watch, name="entity-cache", daemon=True).start()
+
+
+def _remember_changes(session, flush_context):
+    # Runs after each flush, when session.dirty and session.deleted still list what was flushed.
+    # Keys from a rolled back transaction just cause an extra invalidation at the next commit
+    keys = session.info.setdefault("entity_cache_keys", set())
+    for instance in list(session.dirty) + list(session.deleted):
+        identity = inspect(instance).identity
+        if identity is not None and hasattr(instance, "__table__"):
+            keys.add((instance.__table__.name, identity[0]))
+
+
+def _invalidate_committed(session):
+    keys = session.info.pop("entity_cache_keys", None)
+    if keys:
+        for cache in _caches:
+            cache.invalidate(keys)
+
+
+# Every app's cache, the session events below are shared by all of them
+_caches = []
+
+
+def init_entity_cache(app):
+    """ Creates the entity cache if ENTITY_CACHE_SIZE isn't 0
+
+    Args:
+        app (Flask): The application to set the cache up for
+    """
+    if not app.config["ENTITY_CACHE_SIZE"]:
+        return
+
+    # With several workers only the tables other workers' changes can be heard about are cached,
+    # a user deleted through one worker would otherwise stay visible in the others until the TTL
+    tables = OUTBOX_TABLES if app.config["DEPLOYMENT_MODE"] == "multi" else None
+    cache = EntityCache(app.config["ENTITY_CACHE_SIZE"], app.config["ENTITY_CACHE_TTL"], tables)
+    app.extensions["entity_cache"] = cache
+    _caches.append(cache)
+
+    if not event.contains(Session, "after_commit", _invalidate_committed):
+        event.listen(Session, "after_flush", _remember_changes)
+        event.listen(Session, "after_commit", _invalidate_committed)
+
+
+def close_entity_cache(app):
+    """ Stops invalidating the app's entity cache and drops it. Its outbox watcher ends with the
+        app's tailer, see events.close_events
+
+    Args:
+        app (Flask): The application whose cache is dropped
+    """
+    cache = app.extensions.pop("entity_cache", None)
+    if cache is not None:
+        _caches.remove(cache)
+
+
+def cached_get(session: Session, model, ident: int):
+    """ Looks a row up by primary key through the entity cache
+
+    Args:
+        session (Session): The session of the database holding the row
+        model: The model class of the row
+        ident (int): The primary key of the row
+
+    Returns:
+        A snapshot of the row (or the model instance when the cache is off), None if it's missing
+    """
+    cache = current_app.extensions.get("entity_cache")
+    if cache is None or cache.tables is not None and model.__tablename__ not in cache.tables:
+        return session.get(model, ident)
+
+    cache.watch_outbox(get_tailer())
+    return cache.get(session, model, ident)
+
+
+def cached_get_or_404(session: Session, model, ident: int):
+    """ Same as cached_get, but aborts with a 404 when the row doesn't exist
+
+    Args:
+        session (Session): The session of the database holding the row, None means unknown id
+        model: The model class of the row
+        ident (int): The primary key of the row
+
+    Returns:
+        A snapshot of the row, or the model instance when the cache is off
+    """
+    instance = cached_get(session, model, ident) if session is not None else None
+    if instance is None:
+        abort(404)
+    return instance
@@ -0,0 +1,277 @@
+"""
+This file contains the change-data-capture helpers. Every mutation adds a row to the
+outbox_events table in its own transaction, and a single tailer thread per process reads new
+rows and hands them to every subscriber of the /events stream, so subscribers never query the
+database themselves unless they resume from an offset that's no longer buffered. The tailer
+also prunes the events every reader is done with once they're EVENTS_RETENTION seconds old
+"""
+
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+from sqlalchemy import delete, func, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from db import db
+from models import AnalyticsCursorModel, OutboxEventModel
+
+
+def record_event(session, action: str, instance, **extra):
+    """ Adds an outbox event for a change to the session, so it commits with the change
+
+    Args:
+        session (Session): The session the change is being made in
+        action (str): What happened, e.g. created, updated or deleted
+        instance: The store, item or tag that changed, it must already have an id
+        **extra: Additional values to put in the event payload
+    """
+    payload = {column.name: getattr(instance, column.name)
+               for column in instance.__table__.columns}
+    payload.update(extra)
+
+    session.add(OutboxEventModel(entity=instance.__tablename__, entity_id=instance.id,
+                                 action=action, payload=payload))
+
+
+def settled(events: list, offset: int, lag: float) -> list:
+    """ Returns the leading events that no transaction still in flight can come before. Ids are
+        handed out when an event is inserted but only become visible when its transaction
+        commits, so on Postgres a lower id can show up after a higher one. Events past a gap in
+        the ids are held back until the first of them is lag seconds old, by then the missing
+        ids belong to transactions that were rolled back
+
+    Args:
+        events (list): Events after offset, ordered by id
+        offset (int): The id of the last event already handled
+        lag (float): The longest a transaction may take between adding its event and committing
+
+    Returns:
+        list: The events that can be handled, and the offset moved past them
+    """
+    cutoff = time.time() - lag
+    expected = offset + 1
+    for index, event in enumerate(events):
+        if event["id"] != expected and event["created_at"] > cutoff:
+            return events[:index]
+        expected = event["id"] + 1
+    return events
+
+
+def _read_events(engine, after: int, limit: int, until: int = None) -> list:
+    table = OutboxEventModel.__table__
+    query = select(table).where(table.c.id > after).order_by(table.c.id).limit(limit)
+    if until is not None:
+        query = query.where(table.c.id <= until)
+
+    with engine.connect() as connection:
+        return [dict(row._mapping) for row in connection.execute(query)]
+
+
+class OutboxTailer:
+    """ Polls the outbox of every database (one per shard) from a single thread and keeps the
+        latest events in memory for the subscribers
+    """
+
+    def __init__(self, engines: dict, poll_interval: float, buffer_size: int,
+                 commit_lag: float = 0, retention: float = None, prune_interval: float = 60,
+                 batch_size: int = 500):
+        self.engines = engines
+        self.poll_interval = poll_interval
+        self.commit_lag = commit_lag
+        # Seconds events are kept at least, None keeps them forever
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self.batch_size = batch_size
+        self.buffers = {source: deque(maxlen=buffer_size) for source in engines}
+        self.offsets = {}
+        self.changed = threading.Condition()
+        # The live cursor of every subscriber, events they haven't reached aren't pruned
+        self._cursors = {}
+        self._started = False
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """ Starts the tailer thread from the current end of each outbox, if it isn't running """
+        with self._lock:
+            if self._started or self._stopped.is_set():
+                return
+
+            for source, engine in self.engines.items():
+                table = OutboxEventModel.__table__
+                with engine.connect() as connection:
+                    latest = connection.execute(select(func.max(table.c.id))).scalar()
+                self.offsets[source] = latest or 0
+
+            self._thread = threading.Thread(target=self._tail, name="outbox-tailer", daemon=True)
+            self._thread.start()
+            self._started = True
+
+    def stop(self):
+        """ Stops the tailer thread and ends every subscription, the tailer can't be restarted """
+        with self._lock:
+            self._stopped.set()
+        with self.changed:
+            self.changed.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _tail(self):
+        next_prune = time.monotonic() + self.prune_interval
+        while not self._stopped.is_set():
+            found = False
+
+            for source, engine in self.engines.items():
+                offset = self.offsets[source]
+                events = settled(_read_events(engine, offset, self.batch_size), offset,
+                                 self.commit_lag)
+                if events:
+                    found = True
+                    with self.changed:
+                        self.buffers[source].extend(events)
+                        self.offsets[source] = events[-1]["id"]
+                        self.changed.notify_all()
+
+            if self.retention is not None and time.monotonic() >= next_prune:
+                self.prune()
+                next_prune = time.monotonic() + self.prune_interval
+
+            if not found:
+                self._stopped.wait(self.poll_interval)
+
+    def prune(self):
+        """ Deletes the events older than retention that this process's subscribers and the
+            analytics summaries are done with. Workers in other processes read new events within
+            a poll interval, retention is what keeps them (and clients resuming later) covered
+        """
+        table = OutboxEventModel.__table__
+        cutoff = int(time.time() - self.retention)
+
+        for source, engine in self.engines.items():
+            with self.changed:
+                keep = min([self.offsets[source]] +
+                           [cursor[source] for cursor in self._cursors.values()])
+
+            try:
+                with engine.begin() as connection:
+                    summarized = connection.execute(
+                        select(AnalyticsCursorModel.last_event_id)).scalar()
+                    if summarized is not None:
+                        keep = min(keep, summarized)
+                    # The newest event is never deleted, SQLite would hand its id out again
+                    connection.execute(delete(table).where(table.c.id < keep,
+                                                           table.c.created_at < cutoff))
+            except SQLAlchemyError:
+                # Tried again at the next interval, e.g. when the database was locked
+                continue
+
+    def events_after(self, source: str, offset: int) -> list:
+        """ Returns the events of one source that come after offset
+
+        Args:
+            source (str): The database the events come from ("main" or a shard name)
+            offset (int): The id of the last event the subscriber has seen
+
+        Returns:
+            list: The events, from memory if they're still buffered or else from the database
+        """
+        with self.changed:
+            latest = self.offsets[source]
+            if offset >= latest:
+                return []
+
+            buffer = self.buffers[source]
+            if buffer and buffer[0]["id"] <= offset + 1:
+                return [event for event in buffer if event["id"] > offset]
+
+        # Events past the tailer's offset may not be settled yet
+        return _read_events(self.engines[source], offset, self.batch_size, until=latest)
+
+    def subscribe(self, cursor: dict, heartbeat: float):
+        """ Generator of every event after cursor, yields None when nothing happened for
+            heartbeat seconds so the caller can check that the client is still connected
+
+        Args:
+            cursor (dict): The last offset seen per source, missing sources start from now
+            heartbeat (float): Seconds to wait for new events before yielding None
+
+        Yields:
+            tuple: The updated cursor and the event
+        """
+        self.start()
+        cursor = {source: cursor.get(source, self.offsets[source]) for source in self.engines}
+        key = object()
+        with self.changed:
+            self._cursors[key] = cursor
+
+        try:
+            while not self._stopped.is_set():
+                sent = False
+                for source in self.engines:
+                    for event in self.events_after(source, cursor[source]):
+                        cursor[source] = event["id"]
+                        sent = True
+                        yield cursor, event
+
+                if not sent:
+                    with self.changed:
+                        if self._stopped.is_set():
+                            return
+                        idle = (all(cursor[source] >= self.offsets[source]
+                                    for source in self.engines)
+                                and not self.changed.wait(timeout=heartbeat))
+                    if idle:
+                        yield None
+        finally:
+            with self.changed:
+                self._cursors.pop(key, None)
+
+
+def get_tailer() -> OutboxTailer:
+    """ Returns the app's outbox tailer, creating it the first time it's needed
+
+    Returns:
+        OutboxTailer: The tailer for the main database, or for every shard when sharding is on
+    """
+    tailer = current_app.extensions.get("events")
+    if tailer is None:
+        router = current_app.extensions.get("sharding")
+        engines = dict(router.engines) if router is not None else {"main": db.engine}
+        tailer = current_app.extensions.setdefault("events", OutboxTailer(
+            engines,
+            current_app.config["EVENTS_POLL_INTERVAL"],
+            current_app.config["EVENTS_BUFFER_SIZE"],
+            commit_lag=current_app.config["EVENTS_COMMIT_LAG"],
+            retention=current_app.config["EVENTS_RETENTION"] or None,
+            prune_interval=current_app.config["EVENTS_PRUNE_INTERVAL"],
+        ))
+
+    return tailer
+
+
+def _start_tailer():
+    get_tailer().start()
+
+
+def init_events(app):
+    """ Starts the outbox tailer with the app's first request, so the outbox is pruned even
+        when nothing subscribes to it
+
+    Args:
+        app (Flask): The application holding the EVENTS_* settings
+    """
+    app.before_request(_start_tailer)
+
+
+def close_events(app):
+    """ Stops the app's outbox tailer, if it was started, and ends its subscriptions
+
+    Args:
+        app (Flask): The application whose tailer is stopped
+    """
+    tailer = app.extensions.pop("events", None)
+    if tailer is not None:
+        tailer.stop()
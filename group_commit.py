@@ -0,0 +1,198 @@
+"""
+This file contains the optional group committer. When GROUP_COMMIT_WINDOW_MS is set, writes
+from concurrent requests are queued to one writer thread per database that runs them together
+in a single transaction, so a burst of requests pays for one commit (one fsync on SQLite)
+instead of one each. Every request still gets its own result or error back
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from flask import current_app
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from deadlines import DeadlineExceeded, no_deadline, remaining, with_deadline
+
+
+class GroupCommitter:
+    """ Runs queued units of work in shared transactions, one writer thread per engine """
+
+    def __init__(self, window: float, max_batch: int):
+        self.window = window
+        self.max_batch = max_batch
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def submit(self, engine, work):
+        """ Queues work for the engine's writer and waits until its batch is committed. The work
+            runs under the calling request's deadline, and once the deadline passes the request
+            stops waiting with DeadlineExceeded (and work the writer hasn't started is dropped)
+
+        Args:
+            engine (Engine): The engine the work has to be written to
+            work: Callable taking the writer's Session, its return value is passed back
+
+        Returns:
+            The value returned by work, or raises the error it (or the commit) raised
+        """
+        def expired() -> bool:
+            left = remaining()
+            return left is not None and left <= 0
+
+        def run(session):
+            if expired():
+                raise DeadlineExceeded("The request's deadline passed before the write started.")
+            # Interrupting a statement can roll back the whole shared transaction on SQLite, so
+            # the work runs to the end and its savepoint undoes it if the deadline passed
+            with no_deadline():
+                result = work(session)
+            if expired():
+                raise DeadlineExceeded("The request's deadline passed while its write ran.")
+            return result
+
+        future = Future()
+        self._queue_for(engine).put((with_deadline(run), future))
+        try:
+            return future.result(timeout=remaining())
+        except FutureTimeout:
+            future.cancel()
+            raise DeadlineExceeded("The write wasn't committed before the request's deadline.")
+
+    def _queue_for(self, engine) -> queue.Queue:
+        with self._lock:
+            if engine not in self._queues:
+                self._queues[engine] = queue.Queue()
+                threading.Thread(target=self._write_loop, args=(engine, self._queues[engine]),
+                                 name="group-commit", daemon=True).start()
+            return self._queues[engine]
+
+    def _next_batch(self, pending: queue.Queue) -> list:
+        batch = [pending.get()]
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(pending.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def close(self):
+        """ Stops every writer thread once the units already queued are written """
+        with self._lock:
+            for pending in self._queues.values():
+                pending.put(None)
+            self._queues.clear()
+
+    def _write_loop(self, engine, pending: queue.Queue):
+        stopping = False
+        while not stopping:
+            units = self._next_batch(pending)
+            # None is queued by close, and units whose request gave up waiting are dropped
+            stopping = None in units
+            batch = [(work, future) for work, future in filter(None, units)
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._write_batch(engine, batch)
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    @staticmethod
+    def _in_transaction(connection) -> bool:
+        if connection.dialect.name != "sqlite":
+            return True
+        return connection.connection.dbapi_connection.in_transaction
+
+    @staticmethod
+    def _write_batch(engine, batch: list):
+        done = []
+
+        with Session(engine) as session:
+            connection = session.connection()
+            if connection.dialect.name == "sqlite":
+                # pysqlite only emits BEGIN before DML, so the first SAVEPOINT would open (and
+                # its RELEASE commit) a transaction of its own. An explicit BEGIN makes the
+                # savepoints nest in one transaction that's committed once
+                connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+            # Each unit of work gets a savepoint so one failing request doesn't undo the others
+            for work, future in batch:
+                try:
+                    with session.begin_nested():
+                        done.append((future, work(session)))
+                except Exception as error:
+                    future.set_exception(error)
+
+                # Some SQLite errors roll back the whole transaction, not just the savepoint,
+                # and the commit would then succeed without writing anything
+                if not GroupCommitter._in_transaction(connection):
+                    raise OperationalError("COMMIT", None, RuntimeError(
+                        "The batch's transaction was rolled back, none of it was written."))
+
+            try:
+                session.commit()
+            except Exception as error:
+                for future, _ in done:
+                    future.set_exception(error)
+            else:
+                for future, result in done:
+                    future.set_result(result)
+
+
+def init_group_commit(app):
+    """ Starts the group committer if GROUP_COMMIT_WINDOW_MS is configured
+
+    Args:
+        app (Flask): The application to set group commit up for
+    """
+    window = app.config.get("GROUP_COMMIT_WINDOW_MS")
+    if not window:
+        return
+
+    app.extensions["group_commit"] = GroupCommitter(window / 1000,
+                                                    app.config["GROUP_COMMIT_MAX_BATCH"])
+
+
+def close_group_commit(app):
+    """ Stops the app's group committer, if it was started
+
+    Args:
+        app (Flask): The application whose writer threads are stopped
+    """
+    committer = app.extensions.pop("group_commit", None)
+    if committer is not None:
+        committer.close()
+
+
+def run_write(session: Session, work):
+    """ Runs work against session and commits it, through the group committer when it's enabled
+
+    Args:
+        session (Session): The request's session for the database being written to
+        work: Callable taking a Session that makes the changes. Under group commit it runs
+            on the writer thread, so it should return plain values (like ids), not instances
+
+    Returns:
+        The value returned by work
+    """
+    committer = current_app.extensions.get("group_commit")
+    if committer is None:
+        result = work(session)
+        session.commit()
+        return result
+
+    result = committer.submit(session.get_bind(), work)
+    # The writer committed on its own connection, so drop anything this session has cached
+    session.expire_all()
+    return result
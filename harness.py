@@ -0,0 +1,247 @@
+"""
+This file contains the local multi-process harness. It seeds one SQLite database, starts
+several workers on it in DEPLOYMENT_MODE=multi (each a separate process with its own
+server), checks that logging out, cached reads, rate limits and the request metrics behave
+the same whichever worker a request lands on, then measures how read throughput scales from 1 to N workers.
+
+    python harness.py --workers 4 --duration 5
+"""
+
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import random
+import secrets
+import socket
+import sys
+import tempfile
+import time
+
+import click
+
+RATE_LIMIT = 30
+RATE_LIMITED_ENDPOINT = "Tags.TagAutocomplete"
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _serve(port: int, env: dict):
+    os.environ.update(env)
+    # One log line per request would make the workers wait on the terminal
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    app = create_app()
+    # Tokens carry the user id as an integer subject, which newer PyJWT releases reject
+    app.config["JWT_VERIFY_SUB"] = False
+    make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+
+
+def request(port: int, method: str, path: str, body=None, token: str = None) -> tuple:
+    """ Sends one request to a worker
+
+    Args:
+        port (int): The worker's port
+        method (str): The HTTP method
+        path (str): The path and query string
+        body (optional): A value sent as JSON
+        token (str, optional): An access token sent as a bearer token
+
+    Returns:
+        tuple: The status code and the decoded JSON body (None if it isn't JSON)
+    """
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = connection.getresponse()
+        data = response.read()
+    finally:
+        connection.close()
+
+    try:
+        return response.status, json.loads(data)
+    except ValueError:
+        return response.status, None
+
+
+class Cluster:
+    """ Starts workers serving one database and stops them on exit """
+
+    def __init__(self, count: int, env: dict):
+        self.env = env
+        self.ports = [_free_port() for _ in range(count)]
+        self.processes = []
+
+    def __enter__(self):
+        context = multiprocessing.get_context("spawn")
+        for port in self.ports:
+            process = context.Process(target=_serve, args=(port, self.env), daemon=True)
+            process.start()
+            self.processes.append(process)
+
+        for port in self.ports:
+            deadline = time.monotonic() + 60
+            while True:
+                try:
+                    if request(port, "GET", "/metrics")[0] == 200:
+                        break
+                except OSError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"The worker on port {port} didn't start.")
+                time.sleep(0.1)
+        return self
+
+    def __exit__(self, *exc):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+
+    def login(self, port: int) -> str:
+        """ Logs the seeded admin in through one worker and returns a fresh access token """
+        status, body = request(port, "POST", "/login",
+                               {"username": "user1", "password": "password"})
+        if status != 200:
+            raise RuntimeError(f"Logging in failed with {status}: {body}")
+        return body["access_token"]
+
+
+def check_logout(cluster: Cluster) -> str:
+    """ A token revoked through one worker must be refused by every worker """
+    token = cluster.login(cluster.ports[0])
+    before = [request(port, "POST", "/item/bulk", [], token)[0] for port in cluster.ports]
+    request(cluster.ports[-1], "POST", "/logout", token=token)
+    after = [request(port, "POST", "/item/bulk", [], token)[0] for port in cluster.ports]
+
+    if set(before) != {201} or set(after) != {401}:
+        raise AssertionError(f"Token accepted {before} before and {after} after logout.")
+    return "token revoked on every worker"
+
+
+def check_cache(cluster: Cluster, item_id: int = 1) -> str:
+    """ An update made through one worker must reach every worker's entity cache """
+    path = f"/item/{item_id}?fields=name,price"
+    _, item = request(cluster.ports[0], "GET", path)
+    for port in cluster.ports:
+        request(port, "GET", path)
+
+    price = round(item["price"] + 1, 2)
+    token = cluster.login(cluster.ports[0])
+    status, _ = request(cluster.ports[0], "PUT", f"/item/{item_id}",
+                        {"name": item["name"], "price": price}, token)
+    if status != 200:
+        raise AssertionError(f"Updating the item failed with {status}.")
+
+    updated_at = time.monotonic()
+    stale = set(cluster.ports)
+    while stale and time.monotonic() - updated_at < 10:
+        stale = {port for port in stale if request(port, "GET", path)[1]["price"] != price}
+        time.sleep(0.02)
+
+    if stale:
+        raise AssertionError(f"Workers on ports {sorted(stale)} still serve the old price.")
+    return f"update seen by every worker within {time.monotonic() - updated_at:.2f}s"
+
+
+def check_rate_limit(cluster: Cluster) -> str:
+    """ The rate limit must hold for the cluster as a whole, not per worker """
+    statuses = [
+        request(cluster.ports[index % len(cluster.ports)], "GET",
+                "/store/1/tag/autocomplete?prefix=store1")[0]
+        for index in range(RATE_LIMIT * 2)
+    ]
+
+    allowed, limited = statuses.count(200), statuses.count(429)
+    if allowed != RATE_LIMIT or limited != RATE_LIMIT:
+        raise AssertionError(f"{allowed} requests allowed and {limited} limited, expected "
+                             f"{RATE_LIMIT} of each.")
+    return f"{allowed} allowed and {limited} limited across {len(cluster.ports)} workers"
+
+
+def check_metrics(cluster: Cluster) -> str:
+    """ Every worker must report the requests rate limited by all of them, run after
+        check_rate_limit
+    """
+    key = f"{RATE_LIMITED_ENDPOINT}.rate_limited"
+    counts = [request(port, "GET", "/metrics")[1]["overload"].get(key) for port in cluster.ports]
+
+    if set(counts) != {RATE_LIMIT}:
+        raise AssertionError(f"Workers report {counts} rate limited requests, expected "
+                             f"{RATE_LIMIT} from each.")
+    return f"{RATE_LIMIT} rate limited requests reported by every worker"
+
+
+def _load(ports: list, duration: float, items: int, seed: int) -> int:
+    rng = random.Random(seed)
+    done = 0
+    stop_at = time.monotonic() + duration
+    while time.monotonic() < stop_at:
+        port = ports[done % len(ports)]
+        request(port, "GET", f"/item/{rng.randint(1, items)}?fields=id,name,price")
+        done += 1
+    return done
+
+
+def measure_throughput(cluster: Cluster, clients: int, duration: float, items: int) -> float:
+    """ Runs clients load generating processes against the cluster for duration seconds
+
+    Returns:
+        float: The number of requests served per second
+    """
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(clients) as pool:
+        counts = pool.starmap(_load, [(cluster.ports, duration, items, seed)
+                                      for seed in range(clients)])
+    return sum(counts) / duration
+
+
+@click.command()
+@click.option("--workers", default=4, show_default=True, help="Largest number of workers.")
+@click.option("--duration", default=5.0, show_default=True, help="Seconds per throughput run.")
+@click.option("--clients", default=8, show_default=True, help="Load generating processes.")
+@click.option("--items", default=10000, show_default=True, help="Items in the seeded catalog.")
+def main(workers: int, duration: float, clients: int, items: int):
+    """ Checks shared state consistency across workers and reports throughput scaling """
+    from seed import SeedSnapshot
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "harness.db")
+        SeedSnapshot(items=items, stores=20, users=3).save(database)
+        env = {
+            "DATABASE_URL": f"sqlite:///{database}",
+            "DEPLOYMENT_MODE": "multi",
+            "JWT_SECRET_KEY": secrets.token_hex(32),
+            "RATE_LIMITS": f"{RATE_LIMITED_ENDPOINT}={RATE_LIMIT}",
+            "RATE_LIMIT_WINDOW": "3600",
+        }
+
+        click.echo(f"Consistency checks with {workers} workers:")
+        with Cluster(workers, env) as cluster:
+            for check in (check_logout, check_cache, check_rate_limit, check_metrics):
+                click.echo(f"  {check.__name__}: {check(cluster)}")
+
+        click.echo(f"Throughput of GET /item/<id> with {clients} clients "
+                   f"on {os.cpu_count()} CPUs:")
+        baseline = None
+        for count in range(1, workers + 1):
+            with Cluster(count, env) as cluster:
+                throughput = measure_throughput(cluster, clients, duration, items)
+            baseline = baseline or throughput
+            click.echo(f"  {count} worker(s): {throughput:8.0f} req/s "
+                       f"({throughput / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+This file contains the JWT signing key setup and the verified-token cache. Besides the default
+HS256 secret, tokens can be signed with RS256 or EdDSA keys loaded from files. Public keys are
+looked up by the token's kid header, so keys can be rotated by adding a new key file and
+switching JWT_KEY_ID, and edge services can verify tokens with the same public key files
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask_jwt_extended import JWTManager
+from jwt.exceptions import InvalidTokenError
+
+
+class CachingJWTManager(JWTManager):
+    """ JWTManager that remembers tokens it has already verified until they expire, so repeat
+        requests with the same token skip the signature check. The blocklist loader still
+        runs on every request, so logging out takes effect straight away
+    """
+
+    def __init__(self, app=None, cache_size: int = 4096, **kwargs):
+        self.cache_size = cache_size
+        self._verified = OrderedDict()
+        self._lock = threading.Lock()
+        super().__init__(app, **kwargs)
+
+    def _decode_jwt_from_config(self, encoded_token: str, csrf_value=None,
+                                allow_expired: bool = False) -> dict:
+        # Tokens checked against a CSRF value or allowed to be expired aren't worth caching
+        if csrf_value is not None or allow_expired or not self.cache_size:
+            return super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+
+        key = hashlib.sha256(encoded_token.encode()).digest()
+        with self._lock:
+            payload = self._verified.get(key)
+            if payload is not None:
+                if payload.get("exp", float("inf")) > time.time():
+                    self._verified.move_to_end(key)
+                    return dict(payload)
+                del self._verified[key]
+
+        payload = super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+
+        with self._lock:
+            self._verified[key] = payload
+            if len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
+
+        return dict(payload)
+
+
+def _read_key(path: str) -> str:
+    with open(path, encoding="utf-8") as key_file:
+        return key_file.read()
+
+
+def init_signing_keys(app, jwt: JWTManager):
+    """ Registers the key loaders for asymmetric algorithms (RS256, EdDSA, ...).
+        For HS algorithms nothing is registered and JWT_SECRET_KEY is used as before
+
+    Args:
+        app (Flask): The application holding the JWT_* configuration
+        jwt (JWTManager): The JWT manager to register the loaders on
+    """
+    if app.config["JWT_ALGORITHM"].startswith("HS"):
+        return
+
+    key_id = app.config["JWT_KEY_ID"]
+    private_key = _read_key(app.config["JWT_PRIVATE_KEY_FILE"])
+
+    # Every <kid>.pem in the public key directory is accepted, so tokens signed with a
+    # previous key stay valid until they expire
+    keys_dir = app.config["JWT_PUBLIC_KEYS_DIR"]
+    public_keys = {
+        os.path.splitext(name)[0]: _read_key(os.path.join(keys_dir, name))
+        for name in os.listdir(keys_dir)
+        if name.endswith(".pem")
+    }
+
+    @jwt.encode_key_loader
+    def encode_key(identity):
+        return private_key
+
+    @jwt.additional_headers_loader
+    def add_key_id_header(identity):
+        return {"kid": key_id}
+
+    @jwt.decode_key_loader
+    def decode_key(jwt_header, jwt_payload):
+        try:
+            return public_keys[jwt_header.get("kid")]
+        except KeyError as error:
+            raise InvalidTokenError("Unknown signing key.") from error
@@ -0,0 +1,109 @@
+"""
+This file contains the helpers used to serve sparse fieldsets. A client can pass
+?fields=id,name to leave out nested relationships, and only the relationships that will
+actually be serialized are loaded, each with the loader strategy that suits it
+"""
+
+from flask import current_app
+from flask_smorest import abort
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, selectinload
+
+from sharding import sessions_for, get_or_404
+from entity_cache import cached_get_or_404
+
+
+def sparse_schema(schema_class, args: dict, **kwargs):
+    """ Builds a schema that only dumps the fields the client asked for
+
+    Args:
+        schema_class: The schema class used by the endpoint
+        args (dict): The loaded FieldsArgsSchema arguments
+        **kwargs: Extra arguments for the schema, like many=True
+
+    Returns:
+        Schema: The schema limited to the requested fields, or the whole schema if none were given
+    """
+    fields = args.get("fields")
+    if not fields:
+        return schema_class(**kwargs)
+
+    dump_fields = {name for name, field in schema_class().fields.items() if not field.load_only}
+    unknown = set(fields) - dump_fields
+    if unknown:
+        abort(400, message=f"Unknown fields: {', '.join(sorted(unknown))}.")
+
+    return schema_class(only=fields, **kwargs)
+
+
+def load_options(model, schema) -> list:
+    """ Returns the loader options for the relationships the schema is going to dump.
+        Collections are loaded with one extra SELECT ... IN query and many-to-one
+        relationships are joined, anything the schema leaves out isn't loaded at all
+
+    Args:
+        model: The model class being queried
+        schema (Schema): The schema the results will be dumped with
+
+    Returns:
+        list: Options to pass to Query.options or Session.get
+    """
+    relationships = inspect(model).relationships
+    options = []
+
+    for name in schema.fields:
+        if name not in relationships:
+            continue
+
+        attribute = getattr(model, name)
+        options.append(selectinload(attribute) if relationships[name].uselist
+                       else joinedload(attribute))
+
+    return options
+
+
+def load_one(session, model, ident: int, schema):
+    """ Loads one row by id for schema. When the schema doesn't dump any relationships the
+        row is served from the entity cache, otherwise it's loaded with load_options
+
+    Args:
+        session (Session): The session of the database holding the row
+        model: The model class to load
+        ident (int): The primary key of the row
+        schema (Schema): The schema the row will be dumped with
+
+    Returns:
+        The row (a snapshot or a model instance), aborts with a 404 if it doesn't exist
+    """
+    options = load_options(model, schema)
+    if not options:
+        return cached_get_or_404(session, model, ident)
+
+    return get_or_404(session, model, ident, options=options)
+
+
+def load_batch(model, schema, idents: list) -> dict:
+    """ Loads many rows by id with one IN query per database, eager loading what schema needs
+
+    Args:
+        model: The model class to load
+        schema (Schema): The schema (many=True) the rows will be dumped with
+        idents (list): The requested ids, at most BATCH_MAX_IDS of them
+
+    Returns:
+        dict: The dumped rows in the order they were asked for, and the ids that weren't found
+    """
+    idents = list(dict.fromkeys(idents))
+    if len(idents) > current_app.config["BATCH_MAX_IDS"]:
+        abort(400, message=f"At most {current_app.config['BATCH_MAX_IDS']} ids can be requested.")
+
+    options = load_options(model, schema)
+    found = {}
+    for session, group in sessions_for(model, idents).items():
+        rows = session.query(model).options(*options).filter(model.id.in_(group)).all()
+        found.update((row.id, row) for row in rows)
+
+    return {
+        "results": schema.dump([found[ident] for ident in idents if ident in found]),
+        "missing": [ident for ident in idents if ident not in found],
+    }
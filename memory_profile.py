@@ -0,0 +1,129 @@
+"""
+This file contains the sampled per-request memory profile. A MEMORY_PROFILE_RATE share of
+requests is traced with tracemalloc, and the peak of what each of them allocated (streamed
+responses included, they're measured once sent) is kept per endpoint in the shared state
+backend for GET /metrics. tracemalloc sees the whole process, so a request is only sampled
+when it's the only one the worker is serving, and its sample is dropped if another request
+starts before it ends. Event streams, which last as long as their client, aren't sampled or
+counted as in flight
+"""
+
+import random
+import threading
+import tracemalloc
+
+from flask import current_app, g, request
+
+from deadlines import no_deadline
+from shared_state import FOREVER, get_shared_state
+
+_lock = threading.Lock()
+# Requests of this worker that haven't finished, and whether one started during the sample
+_in_flight = 0
+_overlapped = False
+
+
+def _start_sample():
+    global _in_flight, _overlapped
+    rate = current_app.config["MEMORY_PROFILE_RATE"]
+    if not rate:
+        return
+
+    with _lock:
+        _in_flight += 1
+        g.memory_profile_in_flight = True
+        if tracemalloc.is_tracing():
+            _overlapped = True
+            return
+        if _in_flight > 1 or random.random() >= rate:
+            return
+
+        tracemalloc.start()
+        _overlapped = False
+        g.memory_profile_endpoint = request.endpoint
+
+
+def _leave():
+    global _in_flight
+    with _lock:
+        _in_flight -= 1
+
+
+def _finish_sample(endpoint: str, shared_state, keep: bool = True):
+    with _lock:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        keep = keep and not _overlapped
+
+    if keep:
+        with no_deadline():
+            shared_state.incr("memory", f"{endpoint}:samples", FOREVER)
+            shared_state.incr("memory", f"{endpoint}:peak_total", FOREVER, peak)
+            shared_state.set_max("memory", f"{endpoint}:peak_max", peak, FOREVER)
+
+
+def _end_sample(response):
+    in_flight = g.pop("memory_profile_in_flight", False)
+    endpoint = g.pop("memory_profile_endpoint", None)
+    shared_state = get_shared_state() if endpoint is not None else None
+
+    # An event stream stays open as long as its client, tracing it or waiting for it would keep
+    # the worker from being sampled for that long
+    if response.mimetype == "text/event-stream":
+        if endpoint is not None:
+            _finish_sample(endpoint, shared_state, keep=False)
+        if in_flight:
+            _leave()
+        return response
+
+    # A streamed response is produced after the request ends, it's measured once sent,
+    # outside of the app context
+    def finish():
+        if endpoint is not None:
+            _finish_sample(endpoint, shared_state)
+        if in_flight:
+            _leave()
+
+    if response.is_streamed:
+        response.call_on_close(finish)
+    else:
+        finish()
+    return response
+
+
+def _abandon_sample(exc):
+    # Only still set when the request failed before after_request ran
+    endpoint = g.pop("memory_profile_endpoint", None)
+    if endpoint is not None:
+        _finish_sample(endpoint, get_shared_state())
+    if g.pop("memory_profile_in_flight", False):
+        _leave()
+
+
+def memory_report() -> dict:
+    """ Returns the sampled peak allocation per endpoint
+
+    Returns:
+        dict: The number of samples and the largest and average peak in bytes, per endpoint
+    """
+    metrics = {}
+    for key, value in get_shared_state().counters("memory").items():
+        endpoint, name = key.rsplit(":", 1)
+        metrics.setdefault(endpoint, {})[name] = value
+
+    return {
+        endpoint: {"samples": stats["samples"], "peak_max": stats.get("peak_max", 0),
+                   "peak_avg": stats.get("peak_total", 0) // stats["samples"]}
+        for endpoint, stats in metrics.items() if stats.get("samples")
+    }
+
+
+def init_memory_profile(app):
+    """ Registers the request sampling hooks
+
+    Args:
+        app (Flask): The application holding MEMORY_PROFILE_RATE
+    """
+    app.before_request(_start_sample)
+    app.after_request(_end_sample)
+    app.teardown_request(_abandon_sample)
@@ -4,6 +4,7 @@ from logging.config import fileConfig
 from flask import current_app
 
 from alembic import context
+from sqlalchemy import create_engine
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -90,9 +91,15 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
-    connectable = get_engine()
+    def run_on(connection, prepare=None):
+        # Batch migrations recreate SQLite tables, which foreign key enforcement would block
+        if connection.dialect.name == "sqlite":
+            connection.exec_driver_sql("PRAGMA foreign_keys = OFF")
+            connection.commit()
+
+        if prepare is not None:
+            prepare(connection)
 
-    with connectable.connect() as connection:
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
@@ -103,6 +110,29 @@ def run_migrations_online():
         with context.begin_transaction():
             context.run_migrations()
 
+    connectable = get_engine()
+
+    with connectable.connect() as connection:
+        run_on(connection)
+
+    # Every shard holds the whole schema (only the sharded tables have rows) and is migrated
+    # along with the main database. Migrations can tell them apart with the "shard" attribute
+    if getattr(config.cmd_opts, 'autogenerate', False):
+        return
+
+    from sharding import adopt_legacy_shard
+
+    for url in current_app.config.get("SHARD_DATABASE_URLS", []):
+        logger.info('Migrating shard %s', url)
+        shard_engine = create_engine(url)
+        config.attributes["shard"] = True
+        try:
+            with shard_engine.connect() as connection:
+                run_on(connection, prepare=adopt_legacy_shard)
+        finally:
+            config.attributes["shard"] = False
+            shard_engine.dispose()
+
 
 if context.is_offline_mode():
     run_migrations_offline()
@@ -0,0 +1,35 @@
+"""make tag names unique per store
+
+Revision ID: 7e2c94b1d5a8
+Revises: 0b7a3e5d9c61
+Create Date: 2026-10-19 18:02:41.518203
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7e2c94b1d5a8'
+down_revision = '0b7a3e5d9c61'
+branch_labels = None
+depends_on = None
+
+# The original constraint on tags.name was created without a name. SQLite tables are rebuilt
+# from reflection, where the naming convention gives it one, other databases use their default
+naming_convention = {"uq": "uq_%(table_name)s_%(column_0_name)s"}
+
+
+def _name_constraint():
+    return "uq_tags_name" if op.get_bind().dialect.name == "sqlite" else "tags_name_key"
+
+
+def upgrade():
+    with op.batch_alter_table('tags', naming_convention=naming_convention) as batch_op:
+        batch_op.drop_constraint(_name_constraint(), type_='unique')
+        batch_op.create_unique_constraint('uq_tags_store_id_name', ['store_id', 'name'])
+
+
+def downgrade():
+    with op.batch_alter_table('tags', naming_convention=naming_convention) as batch_op:
+        batch_op.drop_constraint('uq_tags_store_id_name', type_='unique')
+        batch_op.create_unique_constraint(_name_constraint(), ['name'])
@@ -0,0 +1,58 @@
+"""reserve store and item names in the shard directory
+
+Revision ID: 9c5e1b7d3f20
+Revises: 2d8f61a0c4b7
+Create Date: 2026-10-19 20:41:09.385172
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = '9c5e1b7d3f20'
+down_revision = '2d8f61a0c4b7'
+branch_labels = None
+depends_on = None
+
+
+def _backfill_names():
+    # The directory entries of existing stores and items get their names from the shards. If
+    # a name is already taken on several shards only its first row keeps it
+    shard_keys = sa.table('shard_keys', sa.column('id'), sa.column('kind'), sa.column('name'))
+    connection = op.get_bind()
+    seen = set()
+
+    for url in current_app.config.get("SHARD_DATABASE_URLS", []):
+        engine = sa.create_engine(url)
+        with engine.connect() as shard:
+            for kind in ('stores', 'items'):
+                rows = shard.execute(sa.text(f"SELECT id, name FROM {kind} ORDER BY id"))
+                for ident, name in rows:
+                    if (kind, name) in seen:
+                        continue
+                    seen.add((kind, name))
+                    connection.execute(shard_keys.update()
+                                       .where(shard_keys.c.id == ident,
+                                              shard_keys.c.kind == kind)
+                                       .values(name=name))
+        engine.dispose()
+
+
+def upgrade():
+    with op.batch_alter_table('shard_keys', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('name', sa.String(length=80), nullable=True))
+
+    # Only the main database holds the directory, the shards' copy of the table stays empty
+    if not op.get_context().config.attributes.get('shard'):
+        _backfill_names()
+
+    with op.batch_alter_table('shard_keys', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_shard_keys_kind_name', ['kind', 'name'])
+
+
+def downgrade():
+    with op.batch_alter_table('shard_keys', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_shard_keys_kind_name', type_='unique')
+        batch_op.drop_column('name')
@@ -4,4 +4,12 @@ from models.store import StoreModel
 from models.item import ItemModel
 from models.tag import TagModel
 from models.item_tags import ItemTags
-from models.user import UserModel
\ No newline at end of file
+from models.user import UserModel
+from models.shard_key import ShardKeyModel
+from models.item_price import ItemPriceModel
+from models.outbox_event import OutboxEventModel
+from models.store_price_stats import StorePriceStatsModel
+from models.price_histogram import PriceHistogramModel
+from models.tag_pair import TagPairModel
+from models.analytics_cursor import AnalyticsCursorModel
+from models.shared_entry import SharedEntryModel
@@ -0,0 +1,11 @@
+""" Model file used to represent how far the analytics summaries have been refreshed """
+
+from db import db
+
+class AnalyticsCursorModel(db.Model):
+    """ Model class used to record the last outbox event the analytics summaries include """
+
+    __tablename__ = "analytics_cursor"
+
+    id = db.Column(db.Integer, primary_key=True)
+    last_event_id = db.Column(db.Integer, nullable=False, default=0)
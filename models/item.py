@@ -1,17 +1,20 @@
-""" Model file used to represent an item in the database """
-
-from db import db
-
-class ItemModel(db.Model):
-    """ Model class used to represent an item in the database """    
-
-    __tablename__ = "items"
-
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(80), unique=True, nullable=False)
-    description = db.Column(db.String)
-    price = db.Column(db.Float(precision=2), unique=False, nullable=False)
-    store_id = db.Column(db.Integer, db.ForeignKey("stores.id"), unique=False, nullable=False)
-    store = db.relationship("StoreModel", back_populates="items")
-    tags = db.relationship("TagModel", back_populates="items", secondary="items_tags")
+""" Model file used to represent an item in the database """
+
+from db import db
+
+class ItemModel(db.Model):
+    """ Model class used to represent an item in the database """    
+
+    __tablename__ = "items"
+    __table_args__ = (
+        db.Index("ix_items_store_id_price", "store_id", "price"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), unique=True, nullable=False)
+    description = db.Column(db.String)
+    price = db.Column(db.Float(precision=2), unique=False, nullable=False)
+    store_id = db.Column(db.Integer, db.ForeignKey("stores.id"), unique=False, nullable=False)
+    store = db.relationship("StoreModel", back_populates="items")
+    tags = db.relationship("TagModel", back_populates="items", secondary="items_tags")
     
\ No newline at end of file
@@ -0,0 +1,22 @@
+""" Model file used to represent a recorded item price in the database """
+
+import time
+
+from db import db
+
+class ItemPriceModel(db.Model):
+    """ Model class used to represent one entry of an item's price history. Rows are only ever
+        appended, and timestamps are stored as epoch seconds to keep the table small
+    """
+
+    __tablename__ = "item_prices"
+    __table_args__ = (
+        db.Index("ix_item_prices_item_id_recorded_at", "item_id", "recorded_at"),
+        db.Index("ix_item_prices_store_id_recorded_at", "store_id", "recorded_at"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey("items.id", ondelete="CASCADE"), nullable=False)
+    store_id = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float(precision=2), nullable=False)
+    recorded_at = db.Column(db.Integer, nullable=False, default=lambda: int(time.time()))
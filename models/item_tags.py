@@ -6,6 +6,9 @@ class ItemTags(db.Model):
     """ Model class used to represent an item tag in the database """
 
     __tablename__ = "items_tags"
+    __table_args__ = (
+        db.Index("ix_items_tags_item_id_tag_id", "item_id", "tag_id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     item_id = db.Column(db.Integer, db.ForeignKey("items.id"))
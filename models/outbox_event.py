@@ -0,0 +1,19 @@
+""" Model file used to represent a change event in the database outbox """
+
+import time
+
+from db import db
+
+class OutboxEventModel(db.Model):
+    """ Model class used to represent a change to a store, item or tag. Events are written in the
+        same transaction as the change itself and their ids are the offsets clients resume from
+    """
+
+    __tablename__ = "outbox_events"
+
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(20), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.Integer, nullable=False, default=lambda: int(time.time()))
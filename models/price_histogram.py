@@ -0,0 +1,12 @@
+""" Model file used to represent a price histogram bucket in the database """
+
+from db import db
+
+class PriceHistogramModel(db.Model):
+    """ Model class used to represent how many of a store's items fall in one price bucket """
+
+    __tablename__ = "price_histogram"
+
+    store_id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+    item_count = db.Column(db.Integer, nullable=False)
@@ -0,0 +1,20 @@
+""" Model file used to represent a shard directory entry in the database """
+
+from db import db
+
+class ShardKeyModel(db.Model):
+    """ Model class used to record which store (and so which shard) owns a store, item or tag id.
+        Ids are handed out from this table so they stay unique across every shard, and so are the
+        names of stores and items, which the shards can only check among their own rows
+    """
+
+    __tablename__ = "shard_keys"
+    __table_args__ = (
+        db.UniqueConstraint("kind", "name", name="uq_shard_keys_kind_name"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    store_id = db.Column(db.Integer, index=True)
+    # Only set for kinds whose names are unique across every store (stores and items)
+    name = db.Column(db.String(80))
@@ -0,0 +1,20 @@
+""" Model file used to represent an entry of the state shared by every worker """
+
+from db import db
+
+class SharedEntryModel(db.Model):
+    """ Model class used to represent a revoked token, a rate limit counter or any other value
+        that all workers must agree on. Entries are ignored once expires_at (epoch seconds)
+        has passed and purged later
+    """
+
+    __tablename__ = "shared_state"
+    __table_args__ = (
+        db.Index("ix_shared_state_expires_at", "expires_at"),
+    )
+
+    namespace = db.Column(db.String(32), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    # Wide enough for the byte totals of the memory metrics
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+    expires_at = db.Column(db.Integer, nullable=False)
@@ -7,11 +7,11 @@ class StoreModel(db.Model):
 
     __tablename__ = "stores"
 
-    # lazy='dynamic' makes sure the db doesn't retrieve these items until it's called
+    # Relationships are loaded lazily by default, endpoints that serialize them pick a
+    # strategy per query (see loading.load_options) so they're never loaded one by one
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), unique=True, nullable=False)
-    items = db.relationship("ItemModel", back_populates="store",
-                            lazy="dynamic", cascade="all, delete")
-    tags = db.relationship("TagModel", back_populates="store", lazy="dynamic")
+    items = db.relationship("ItemModel", back_populates="store", cascade="all, delete")
+    tags = db.relationship("TagModel", back_populates="store")
     
\ No newline at end of file
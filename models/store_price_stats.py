@@ -0,0 +1,17 @@
+""" Model file used to represent the price statistics summary of a store in the database """
+
+from db import db
+
+class StorePriceStatsModel(db.Model):
+    """ Model class used to represent the materialized price statistics of one store's items """
+
+    __tablename__ = "store_price_stats"
+
+    store_id = db.Column(db.Integer, primary_key=True)
+    item_count = db.Column(db.Integer, nullable=False)
+    price_min = db.Column(db.Float, nullable=False)
+    price_max = db.Column(db.Float, nullable=False)
+    price_avg = db.Column(db.Float, nullable=False)
+    p50 = db.Column(db.Float, nullable=False)
+    p90 = db.Column(db.Float, nullable=False)
+    p99 = db.Column(db.Float, nullable=False)
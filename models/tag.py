@@ -6,9 +6,14 @@ class TagModel(db.Model):
     """ Model class used to represent a tag in the database """
 
     __tablename__ = "tags"
+    # Names only have to be unique within a store, the constraint's (store_id, name) index also
+    # serves the ordered listing and prefix lookups of a store's tags
+    __table_args__ = (
+        db.UniqueConstraint("store_id", "name", name="uq_tags_store_id_name"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(80), unique=True, nullable=False)
+    name = db.Column(db.String(80), nullable=False)
     store_id = db.Column(db.String(), db.ForeignKey("stores.id"), nullable=False)
     store = db.relationship("StoreModel", back_populates="tags")
     items = db.relationship("ItemModel", back_populates="tags", secondary="items_tags")
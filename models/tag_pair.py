@@ -0,0 +1,18 @@
+""" Model file used to represent a tag co-occurrence count in the database """
+
+from db import db
+
+class TagPairModel(db.Model):
+    """ Model class used to represent how many of a store's items have both tag_a and tag_b.
+        Each pair is stored once, with tag_a < tag_b
+    """
+
+    __tablename__ = "tag_pairs"
+    __table_args__ = (
+        db.Index("ix_tag_pairs_store_id_item_count", "store_id", "item_count"),
+    )
+
+    store_id = db.Column(db.Integer, primary_key=True)
+    tag_a = db.Column(db.Integer, primary_key=True)
+    tag_b = db.Column(db.Integer, primary_key=True)
+    item_count = db.Column(db.Integer, nullable=False)
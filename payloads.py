@@ -0,0 +1,150 @@
+"""
+This file contains the helpers that keep a worker's memory bounded by large payloads. Request
+bodies are capped per route (MAX_CONTENT_LENGTH, overridden per endpoint by
+REQUEST_BODY_LIMITS), JSON arrays can be read from the request stream one element at a time,
+and large lists are streamed to the client in batches instead of being built in memory
+"""
+
+import codecs
+import json
+
+from flask import Response, current_app, request, stream_with_context
+from flask_smorest import abort
+
+from deadlines import DeadlineExceeded, iter_with_deadline, record_overload
+
+# Bytes read from the request stream at a time
+READ_SIZE = 64 * 1024
+
+
+def _apply_body_limit():
+    limit = current_app.config["REQUEST_BODY_LIMITS"].get(request.endpoint)
+    if limit is not None:
+        request.max_content_length = limit
+
+
+def init_payload_limits(app):
+    """ Registers the per-endpoint request body limits
+
+    Args:
+        app (Flask): The application holding MAX_CONTENT_LENGTH and REQUEST_BODY_LIMITS
+    """
+    app.before_request(_apply_body_limit)
+
+
+def iter_json_array(stream, max_element_size: int):
+    """ Parses a JSON array from a byte stream, yielding each element as soon as it's complete,
+        so only one element (plus one read) is held in memory at a time
+
+    Args:
+        stream: A file-like object of UTF-8 encoded JSON, like request.stream
+        max_element_size (int): The largest element accepted, in characters
+
+    Yields:
+        The decoded elements of the array, aborts with a 400 if the body isn't a JSON array
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer, position, finished = "", 0, False
+
+    def read_more():
+        nonlocal buffer, position, finished
+        chunk = stream.read(READ_SIZE)
+        finished = not chunk
+        buffer = buffer[position:] + text_decoder.decode(chunk, final=finished)
+        position = 0
+
+    def next_token() -> str:
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or finished:
+                return buffer[position:position + 1]
+            read_more()
+
+    if next_token() != "[":
+        abort(400, message="The request body must be a JSON array.")
+    position += 1
+
+    if next_token() == "]":
+        return
+
+    while True:
+        next_token()
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                element, end = None, None
+
+            # A number can be cut short by the end of a read (1.5 of 1.5e3), so it's only
+            # accepted once something that can't continue it follows
+            complete = end is not None and (finished or end < len(buffer) and not (
+                buffer[end - 1].isdigit() and buffer[end] in "0123456789.eE"))
+            if complete:
+                break
+            if finished:
+                abort(400, message="The request body is not valid JSON.")
+            if len(buffer) - position > max_element_size:
+                abort(413, message=f"Array elements can't be larger than {max_element_size} "
+                                   "characters.")
+            read_more()
+
+        position = end
+        yield element
+
+        separator = next_token()
+        position += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            abort(400, message="The request body is not valid JSON.")
+
+
+def stream_json_array(rows, schema, batch_size: int = 500) -> Response:
+    """ Builds a streamed JSON array response, dumping rows batch_size at a time. The first
+        batch is read before the response starts, so a request that runs out of time by then
+        still gets a 504, and later batches are read under the request's deadline too
+
+    Args:
+        rows: Iterable of model instances, ideally a lazy one like sharding.iter_rows returns
+        schema (Schema): The schema (many=True) each batch is dumped with
+        batch_size (int, optional): How many rows are dumped and sent together
+
+    Returns:
+        Response: A response that produces the array while it's being sent
+    """
+    def dump(batch) -> str:
+        # The batch's array without its brackets, compact like jsonify
+        return json.dumps(schema.dump(batch), separators=(",", ":"))[1:-1]
+
+    def batches():
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield dump(batch)
+                batch = []
+        if batch:
+            yield dump(batch)
+
+    chunks = iter_with_deadline(batches())
+    first = next(chunks, None)
+
+    def generate():
+        yield "[" + (first or "")
+        if first is None:
+            yield "]"
+            return
+        try:
+            for chunk in chunks:
+                yield "," + chunk
+        except DeadlineExceeded:
+            # The status line is already sent, the connection is dropped so the client can't
+            # take the cut off array for the whole list
+            record_overload("timed_out")
+            raise
+        yield "]"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
@@ -0,0 +1,49 @@
+"""
+This file contains the per-client rate limits. Endpoints listed in RATE_LIMITS accept that many
+requests per client in each RATE_LIMIT_WINDOW seconds, counted in the shared state backend so
+the limit holds across every worker, and answer 429 past it. Behind PROXY_COUNT trusted reverse
+proxies the client is read from X-Forwarded-For instead of the proxy's address
+"""
+
+import time
+
+from flask import current_app, jsonify, request
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from deadlines import record_overload
+from shared_state import get_shared_state
+
+
+def _check_rate_limit():
+    endpoint = request.endpoint
+    limit = current_app.config["RATE_LIMITS"].get(endpoint)
+    if limit is None:
+        return None
+
+    window = current_app.config["RATE_LIMIT_WINDOW"]
+    bucket = int(time.time() // window)
+    window_end = (bucket + 1) * window
+    count = get_shared_state().incr("rate_limit", f"{endpoint}:{request.remote_addr}:{bucket}",
+                                    int(window_end))
+    if count <= limit:
+        return None
+
+    record_overload("rate_limited")
+    response = jsonify({"code": 429, "status": "Too Many Requests",
+                        "message": f"At most {limit} requests per {window} seconds are allowed."})
+    response.headers["Retry-After"] = str(max(int(window_end - time.time()), 1))
+    return response, 429
+
+
+def init_rate_limits(app):
+    """ Registers the rate limit check
+
+    Args:
+        app (Flask): The application holding RATE_LIMITS, RATE_LIMIT_WINDOW and PROXY_COUNT
+    """
+    proxies = app.config["PROXY_COUNT"]
+    if proxies:
+        # Each trusted proxy appends the address it got the request from, so the client is the
+        # one that many entries from the end. Anything further left was sent by the client
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+    app.before_request(_check_rate_limit)
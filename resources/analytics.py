@@ -0,0 +1,144 @@
+""" File containing Blueprint and classes for handling the admin analytics HTTP requests """
+
+from flask import current_app
+from flask.views import MethodView
+from flask_smorest import Blueprint, abort
+from flask_jwt_extended import jwt_required, get_jwt
+
+from analytics import refresh
+from entity_cache import cached_get_or_404
+from models import PriceHistogramModel, StoreModel, StorePriceStatsModel, TagPairModel
+from schemas import (PriceStatsSchema, TagPairSchema, TagPairArgsSchema,
+                     AnalyticsRefreshArgsSchema)
+from sharding import store_session, fan_out
+
+blp = Blueprint("Analytics", "analytics", description="Price and tag analytics for admins")
+
+
+def require_admin():
+    """ Aborts with a 401 unless the request's JWT belongs to an admin """
+    if not get_jwt().get("is_admin"):
+        abort(401, message="Admin privilege required.")
+
+
+@blp.route("/store/<int:store_id>/analytics/prices")
+class StorePriceStats(MethodView):
+    """ Class that handles the price distribution report of a store """
+
+    @jwt_required()
+    @blp.response(200, PriceStatsSchema)
+    def get(self, store_id: int) -> dict:
+        """ GET request that returns the price statistics and histogram of a store's items
+
+        Args:
+            store_id (int): The id of the store
+
+        Returns:
+            dict: The count, min, max, average and percentiles of the prices, and the histogram
+        """
+        require_admin()
+
+        session = store_session(store_id)
+        cached_get_or_404(session, StoreModel, store_id)
+        width = current_app.config["ANALYTICS_HISTOGRAM_WIDTH"]
+        refresh(session, width, current_app.config["EVENTS_COMMIT_LAG"])
+
+        stats = session.get(StorePriceStatsModel, store_id)
+        if stats is None:
+            return {"store_id": store_id, "item_count": 0, "histogram": []}
+
+        buckets = session.query(PriceHistogramModel).filter(
+            PriceHistogramModel.store_id == store_id
+        ).order_by(PriceHistogramModel.bucket)
+
+        result = PriceStatsSchema(exclude=("histogram",)).dump(stats)
+        result["histogram"] = [
+            {"bucket_start": bucket.bucket * width, "bucket_end": (bucket.bucket + 1) * width,
+             "count": bucket.item_count}
+            for bucket in buckets
+        ]
+        return result
+
+
+@blp.route("/store/<int:store_id>/analytics/tag-pairs")
+class StoreTagPairs(MethodView):
+    """ Class that handles the tag co-occurrence report of a store """
+
+    @jwt_required()
+    @blp.arguments(TagPairArgsSchema, location="query")
+    @blp.response(200, TagPairSchema(many=True))
+    def get(self, args: dict, store_id: int) -> list:
+        """ GET request that returns the pairs of tags most often found on the same item
+
+        Args:
+            args (dict): How many pairs to return
+            store_id (int): The id of the store
+
+        Returns:
+            list: The tag pairs with the number of items that have both, most common first
+        """
+        require_admin()
+
+        session = store_session(store_id)
+        cached_get_or_404(session, StoreModel, store_id)
+        refresh(session, current_app.config["ANALYTICS_HISTOGRAM_WIDTH"],
+                current_app.config["EVENTS_COMMIT_LAG"])
+
+        return session.query(TagPairModel).filter(TagPairModel.store_id == store_id).order_by(
+            TagPairModel.item_count.desc()
+        ).limit(args["limit"]).all()
+
+
+@blp.route("/analytics/tag-pairs")
+class TagPairs(MethodView):
+    """ Class that handles the tag co-occurrence report across every store """
+
+    @jwt_required()
+    @blp.arguments(TagPairArgsSchema, location="query")
+    @blp.response(200, TagPairSchema(many=True))
+    def get(self, args: dict) -> list:
+        """ GET request that returns the tag pairs most often found on the same item in any store
+
+        Args:
+            args (dict): How many pairs to return
+
+        Returns:
+            list: The tag pairs with the number of items that have both, most common first
+        """
+        require_admin()
+        width = current_app.config["ANALYTICS_HISTOGRAM_WIDTH"]
+        # Read here, the shards are refreshed on threads without the app context
+        lag = current_app.config["EVENTS_COMMIT_LAG"]
+
+        def top_pairs(session):
+            refresh(session, width, lag)
+            return session.query(TagPairModel).order_by(
+                TagPairModel.item_count.desc()
+            ).limit(args["limit"]).all()
+
+        pairs = fan_out(top_pairs, TagPairSchema(many=True), order_by=None)
+        return sorted(pairs, key=lambda pair: pair["item_count"], reverse=True)[:args["limit"]]
+
+
+@blp.route("/analytics/refresh")
+class AnalyticsRefresh(MethodView):
+    """ Class that handles refreshing the analytics summaries on demand """
+
+    @jwt_required()
+    @blp.arguments(AnalyticsRefreshArgsSchema, location="query")
+    def post(self, args: dict) -> dict:
+        """ POST request that refreshes the summaries, e.g. after changing the histogram width
+
+        Args:
+            args (dict): Whether every store should be rebuilt instead of only the changed ones
+
+        Returns:
+            dict: How many stores were rebuilt
+        """
+        require_admin()
+        width = current_app.config["ANALYTICS_HISTOGRAM_WIDTH"]
+        lag = current_app.config["EVENTS_COMMIT_LAG"]
+
+        rebuilt = fan_out(lambda session: [refresh(session, width, lag, full=args["full"])],
+                          order_by=None)
+        return {"stores_rebuilt": sum(rebuilt)}
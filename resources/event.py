@@ -0,0 +1,71 @@
+""" File containing Blueprint and classes for streaming change events over Server-Sent Events """
+
+import json
+
+from flask import Response, current_app, request
+from flask.views import MethodView
+from flask_smorest import Blueprint, abort
+
+from events import get_tailer
+from schemas import EventStreamArgsSchema
+
+blp = Blueprint("Events", "events", description="Stream of changes to stores, items and tags")
+
+
+def parse_cursor(value: str) -> dict:
+    """ Parses a cursor like "main:15" or "shard_0:15,shard_1:3" into offsets per source
+
+    Args:
+        value (str): The cursor sent by the client
+
+    Returns:
+        dict: The last offset seen per source
+    """
+    try:
+        return {source: int(offset) for source, offset in
+                (part.split(":") for part in value.split(",") if part)}
+    except ValueError:
+        abort(400, message="Invalid event cursor.")
+
+
+def format_cursor(cursor: dict) -> str:
+    """ Turns offsets per source back into the cursor sent as each event's id """
+    return ",".join(f"{source}:{offset}" for source, offset in cursor.items())
+
+
+@blp.route("/events")
+class EventStream(MethodView):
+    """ Class that handles the /events Server-Sent Events endpoint """
+
+    @blp.arguments(EventStreamArgsSchema, location="query")
+    @blp.response(200, description="A text/event-stream of change events. Each event's id is "
+                  "the cursor to resume from, sent back as Last-Event-ID or ?after=.")
+    def get(self, args: dict):
+        """ GET request that streams every change made after the given cursor
+
+        Args:
+            args (dict): The cursor to resume from, only new events are sent without one
+
+        Returns:
+            Response: The event stream
+        """
+        cursor = parse_cursor(request.headers.get("Last-Event-ID") or args.get("after", ""))
+        heartbeat = current_app.config["EVENTS_HEARTBEAT"]
+        subscription = get_tailer().subscribe(cursor, heartbeat)
+
+        def stream():
+            for update in subscription:
+                if update is None:
+                    # A comment line, writing it fails once the client has gone away
+                    yield ": keep-alive\n\n"
+                    continue
+
+                cursor, event = update
+                data = {key: event[key] for key in ("entity", "entity_id", "action", "payload",
+                                                    "created_at")}
+                yield (f"id: {format_cursor(cursor)}\n"
+                       f"event: {event['entity']}.{event['action']}\n"
+                       f"data: {json.dumps(data)}\n\n")
+
+        return Response(stream(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,13 +1,24 @@
 """ File containing Blueprint and classes for handling /item HTTP requests """
 
+from collections import defaultdict
+
+from flask import current_app, jsonify, request
 from flask.views import MethodView
 from flask_smorest import Blueprint, abort
-from sqlalchemy.exc import SQLAlchemyError
+from marshmallow import ValidationError
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from flask_jwt_extended import jwt_required, get_jwt
 
-from db import db
-from models import ItemModel
-from schemas import ItemSchema, ItemUpdateSchema
+from models import ItemModel, ItemPriceModel
+from schemas import (ItemSchema, ItemUpdateSchema, FieldsArgsSchema, BatchArgsSchema,
+                     ItemBatchSchema, ItemBulkResultSchema)
+from loading import sparse_schema, load_options, load_one, load_batch
+from sharding import (session_for, store_session, get_or_404, allocate_id, allocate_ids,
+                      rename_id, release_ids, iter_rows)
+from payloads import iter_json_array, stream_json_array
+from group_commit import run_write
+from events import record_event
+from deadlines import DeadlineExceeded, no_deadline, raise_if_timed_out, record_overload
 
 
 blp = Blueprint("Items", __name__, description="Operations on items")
@@ -21,18 +32,21 @@ class Item(MethodView):
     """
 
     # TODO: Add description to 200 response code annotation
+    @blp.arguments(FieldsArgsSchema, location="query")
     @blp.response(200, ItemSchema)
-    def get(self, item_id: int) -> tuple:
+    def get(self, args: dict, item_id: int) -> tuple:
         """Performs GET request to retrieve a specific item
         
         Args:
+            args (dict): The fields to return, all of them by default
             item_id (int): The id of the item to retrieve data of
         Returns:
             dict: Response message/data
             int: The status code of the response
         """
-        item = ItemModel.query.get_or_404(item_id)
-        return item
+        schema = sparse_schema(ItemSchema, args)
+        item = load_one(session_for(ItemModel, item_id), ItemModel, item_id, schema)
+        return jsonify(schema.dump(item))
 
     @jwt_required()
     def delete(self, item_id: int) -> tuple:
@@ -50,9 +64,12 @@ class Item(MethodView):
         if not jwt.get("is_admin"):
             abort(401, message="Admin privilege required.")
 
-        item = ItemModel.query.get_or_404(item_id)
-        db.session.delete(item)
-        db.session.commit()
+        session = session_for(ItemModel, item_id)
+        item = get_or_404(session, ItemModel, item_id)
+        record_event(session, "deleted", item)
+        session.delete(item)
+        session.commit()
+        release_ids(ident=item_id)
         return {"message": "Item deleted."}
 
     # TODO: Add description to 200 response code annotation
@@ -74,18 +91,56 @@ class Item(MethodView):
         if not jwt.get("is_admin"):
             abort(401, message="Admin privilege required.")
 
-        item = ItemModel.query.get(item_id)
+        # With sharding the item's name is reserved (or moved) in the directory first, and put
+        # back if the write fails
+        session = session_for(ItemModel, item_id)
+        try:
+            if session is None:
+                session = store_session(item_data.get("store_id"))
+                allocate_id(ItemModel, item_data.get("store_id"), ident=item_id,
+                            name=item_data.get("name"))
+                created, previous_name = True, None
+            else:
+                created, previous_name = False, rename_id(ItemModel, item_id,
+                                                          item_data.get("name"))
+        except IntegrityError:
+            abort(400, message="An item with that name already exists.")
+
+        def write(writer):
+            item = writer.get(ItemModel, item_id)
+            action = "updated" if item else "created"
+            price_changed = item is None or item.price != item_data["price"]
 
-        if item:
-            item.price = item_data["price"]
-            item.name = item_data["name"]
-        else:
-            item = ItemModel(id=item_id, **item_data)
+            if item:
+                item.price = item_data["price"]
+                item.name = item_data["name"]
+            else:
+                item = ItemModel(id=item_id, **item_data)
 
-        db.session.add(item)
-        db.session.commit()
+            writer.add(item)
+            writer.flush()
+            if price_changed:
+                writer.add(ItemPriceModel(item_id=item.id, store_id=item.store_id,
+                                          price=item.price))
+            record_event(writer, action, item)
+
+        def undo_reservation():
+            if created:
+                release_ids(ident=item_id)
+            elif previous_name is not None:
+                with no_deadline():
+                    rename_id(ItemModel, item_id, previous_name)
+
+        try:
+            run_write(session, write)
+        except IntegrityError:
+            undo_reservation()
+            abort(400, message="An item with that name already exists.")
+        except (SQLAlchemyError, DeadlineExceeded):
+            undo_reservation()
+            raise
 
-        return item
+        return session.get(ItemModel, item_id)
 
 
 @blp.route("/item")
@@ -97,14 +152,21 @@ class ItemList(MethodView):
     """
 
     # TODO: Add description to 200 response code annotation
+    @blp.arguments(FieldsArgsSchema, location="query")
     @blp.response(200, ItemSchema(many=True))
-    def get(self) -> dict:
+    def get(self, args: dict) -> dict:
         """ Retrieves all items in the database
 
+        Args:
+            args (dict): The fields to return, all of them by default
+
         Returns:
             dict: a dict containing all of the items
         """
-        return ItemModel.query.all()
+        schema = sparse_schema(ItemSchema, args, many=True)
+        options = load_options(ItemModel, schema)
+        rows = iter_rows(ItemModel, lambda session: session.query(ItemModel).options(*options))
+        return stream_json_array(rows, schema)
 
     # TODO: Add description to 201 response code annotation
     @jwt_required(fresh=True)
@@ -122,13 +184,138 @@ class ItemList(MethodView):
         if not jwt.get("is_admin"):
             abort(401, message="Admin privilege required.")
 
-        item = ItemModel(**item_data)
+        session = store_session(item_data["store_id"])
+        try:
+            reserved_id = allocate_id(ItemModel, item_data["store_id"], name=item_data["name"])
+        except SQLAlchemyError as error:
+            raise_if_timed_out(error)
+            abort(500, message="An error occurred while inserting the item.")
+
+        def write(writer):
+            item = ItemModel(id=reserved_id, **item_data)
+            writer.add(item)
+            writer.flush()
+            writer.add(ItemPriceModel(item_id=item.id, store_id=item.store_id, price=item.price))
+            record_event(writer, "created", item)
+            return item.id
 
         try:
-            db.session.add(item)
-            db.session.commit()  # writes item to data.db
-        except SQLAlchemyError:
+            item_id = run_write(session, write)  # writes item to the store's shard
+        except (SQLAlchemyError, DeadlineExceeded) as error:
+            release_ids(ident=reserved_id)
+            raise_if_timed_out(error)
             abort(500, message="An error occurred while inserting the item.")
 
-        return item
-    
\ No newline at end of file
+        return session.get(ItemModel, item_id)
+    
+
+
+def insert_items(store_id: int, items: list):
+    """ Writes a batch of validated items of one store in a single transaction
+
+    Args:
+        store_id (int): The store the items belong to
+        items (list): The loaded ItemSchema data of each item
+    """
+    session = store_session(store_id)
+    # One directory transaction reserves the ids (and names) of the whole batch
+    try:
+        item_ids = allocate_ids(ItemModel, store_id, names=[item["name"] for item in items])
+    except SQLAlchemyError as error:
+        raise_if_timed_out(error)
+        raise
+
+    def write(writer):
+        rows = [ItemModel(id=item_id, **item_data) for item_id, item_data in zip(item_ids, items)]
+        writer.add_all(rows)
+        writer.flush()
+        for item in rows:
+            writer.add(ItemPriceModel(item_id=item.id, store_id=item.store_id, price=item.price))
+            record_event(writer, "created", item)
+
+    try:
+        run_write(session, write)
+    except (SQLAlchemyError, DeadlineExceeded) as error:
+        release_ids(idents=item_ids)
+        raise_if_timed_out(error)
+        raise
+
+
+@blp.route("/item/bulk")
+class ItemBulk(MethodView):
+    """ Class used to handle HTTP requests for the /item/bulk endpoint """
+
+    @jwt_required(fresh=True)
+    @blp.response(201, ItemBulkResultSchema)
+    def post(self) -> dict:
+        """ POST request that creates the items of a JSON array body. The body is parsed
+            while it's being received and items are written BULK_BATCH_SIZE at a time, so an
+            import of any size only keeps one batch in memory. If an item is invalid the
+            import stops there and the batches before it stay created
+
+        Returns:
+            dict: The number of items created
+        """
+        jwt = get_jwt()
+        if not jwt.get("is_admin"):
+            abort(401, message="Admin privilege required.")
+
+        schema = ItemSchema()
+        batch_size = current_app.config["BULK_BATCH_SIZE"]
+        pending, pending_count, created = defaultdict(list), 0, 0
+
+        def flush():
+            nonlocal created
+            for store_id, items in pending.items():
+                try:
+                    insert_items(store_id, items)
+                except DeadlineExceeded:
+                    record_overload("timed_out")
+                    abort(504, message=f"The import took too long and was cancelled, {created} "
+                                       "items were created before it.")
+                except IntegrityError:
+                    abort(400, message=f"An item name is already taken, {created} items "
+                                       "were created before it.")
+                except SQLAlchemyError:
+                    abort(500, message="An error occurred while inserting the items.")
+                # Each store's batch is committed on its own, the count must include it even if
+                # a later store's batch fails
+                created += len(items)
+            pending.clear()
+
+        elements = iter_json_array(request.stream, current_app.config["BULK_MAX_ELEMENT_SIZE"])
+        for index, element in enumerate(elements):
+            try:
+                item_data = schema.load(element)
+            except ValidationError as error:
+                abort(422, errors={"json": {index: error.messages}},
+                      message=f"Item {index} is invalid, {created} items were created "
+                              "before it.")
+
+            pending[item_data["store_id"]].append(item_data)
+            pending_count += 1
+            if pending_count == batch_size:
+                flush()
+                pending_count = 0
+
+        flush()
+        return {"created": created}
+
+
+@blp.route("/item/batch")
+class ItemBatch(MethodView):
+    """ Class used to handle HTTP requests for the /item/batch endpoint """
+
+    @blp.arguments(BatchArgsSchema, location="query")
+    @blp.response(200, ItemBatchSchema)
+    def get(self, args: dict) -> dict:
+        """ GET request that retrieves several items with one query
+
+        Args:
+            args (dict): The ids of the items to retrieve and, optionally, the fields to return
+
+        Returns:
+            dict: The items found, in the order of ids, and the ids that weren't found
+        """
+        schema = sparse_schema(ItemSchema, args, many=True)
+        return jsonify(load_batch(ItemModel, schema, args["ids"]))
@@ -0,0 +1,22 @@
+""" File containing Blueprint and classes for the request metrics endpoint """
+
+from flask.views import MethodView
+from flask_smorest import Blueprint
+
+from deadlines import overload_report
+from memory_profile import memory_report
+
+blp = Blueprint("Metrics", "metrics", description="Request timeout, rejection and memory counters")
+
+
+@blp.route("/metrics")
+class Metrics(MethodView):
+    """ Class that handles the /metrics endpoint """
+
+    @blp.response(200)
+    def get(self):
+        """ Returns the number of requests timed out or rejected, summed over every worker, and
+            the peak allocation of the requests sampled while they were their worker's only one,
+            per endpoint
+        """
+        return {"overload": overload_report(), "memory": memory_report()}
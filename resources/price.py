@@ -0,0 +1,82 @@
+""" File containing Blueprint and classes for handling price history HTTP requests """
+
+from flask.views import MethodView
+from flask_smorest import Blueprint
+from sqlalchemy import func
+
+from models import ItemModel, ItemPriceModel, StoreModel
+from schemas import PriceHistoryArgsSchema, PriceBucketSchema
+from sharding import session_for, store_session
+from entity_cache import cached_get_or_404
+
+blp = Blueprint("Prices", "prices", description="Operations on price history")
+
+
+def downsample(session, column, key: int, args: dict) -> list:
+    """ Groups the price history rows matching column == key into buckets in SQL
+
+    Args:
+        session (Session): The session of the database holding the history
+        column: ItemPriceModel.item_id or ItemPriceModel.store_id
+        key (int): The id to filter column by
+        args (dict): The loaded PriceHistoryArgsSchema arguments
+
+    Returns:
+        list: One row per non-empty bucket with its start time and min/max/avg/count
+    """
+    bucket_start = (ItemPriceModel.recorded_at // args["bucket"]) * args["bucket"]
+
+    query = session.query(
+        bucket_start.label("bucket_start"),
+        func.min(ItemPriceModel.price).label("min"),
+        func.max(ItemPriceModel.price).label("max"),
+        func.avg(ItemPriceModel.price).label("avg"),
+        func.count().label("count"),
+    ).filter(column == key, ItemPriceModel.recorded_at >= args["start"])
+
+    if "end" in args:
+        query = query.filter(ItemPriceModel.recorded_at < args["end"])
+
+    return query.group_by(bucket_start).order_by(bucket_start).all()
+
+
+@blp.route("/item/<int:item_id>/price-history")
+class ItemPriceHistory(MethodView):
+    """ Class that handles the price history of a single item """
+
+    @blp.arguments(PriceHistoryArgsSchema, location="query")
+    @blp.response(200, PriceBucketSchema(many=True))
+    def get(self, args: dict, item_id: int) -> list:
+        """ GET request that returns an item's prices downsampled into buckets
+
+        Args:
+            args (dict): The time range and bucket size, in epoch seconds
+            item_id (int): The id of the item
+
+        Returns:
+            list: The min, max and average price of each bucket
+        """
+        session = session_for(ItemModel, item_id)
+        cached_get_or_404(session, ItemModel, item_id)
+        return downsample(session, ItemPriceModel.item_id, item_id, args)
+
+
+@blp.route("/store/<int:store_id>/price-history")
+class StorePriceHistory(MethodView):
+    """ Class that handles the price history of every item in a store """
+
+    @blp.arguments(PriceHistoryArgsSchema, location="query")
+    @blp.response(200, PriceBucketSchema(many=True))
+    def get(self, args: dict, store_id: int) -> list:
+        """ GET request that returns the prices of a store's items downsampled into buckets
+
+        Args:
+            args (dict): The time range and bucket size, in epoch seconds
+            store_id (int): The id of the store
+
+        Returns:
+            list: The min, max and average price of each bucket
+        """
+        session = store_session(store_id)
+        cached_get_or_404(session, StoreModel, store_id)
+        return downsample(session, ItemPriceModel.store_id, store_id, args)
@@ -1,13 +1,18 @@
 """ File containing Blueprint and classes for handling /store HTTP requests """
 
+from flask import jsonify
 from flask.views import MethodView
 from flask_smorest import Blueprint, abort
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from flask_jwt_extended import jwt_required, get_jwt
 
-from db import db
 from models import StoreModel
-from schemas import StoreSchema
+from schemas import StoreSchema, FieldsArgsSchema, BatchArgsSchema, StoreBatchSchema
+from loading import sparse_schema, load_options, load_one, load_batch
+from events import record_event
+from sharding import store_session, get_or_404, allocate_id, release_ids, iter_rows
+from payloads import stream_json_array
+from deadlines import DeadlineExceeded, raise_if_timed_out
 
 blp = Blueprint("stores", __name__, description="Operations on stores")
 
@@ -20,18 +25,21 @@ class Store(MethodView):
     """
 
     # TODO: Add description to 200 response code annotation
+    @blp.arguments(FieldsArgsSchema, location="query")
     @blp.response(200, StoreSchema)
-    def get(self, store_id: int) -> tuple:
+    def get(self, args: dict, store_id: int) -> tuple:
         """ GET request handler for the /store/store_id endpoint
 
         Args:
+            args (dict): The fields to return, all of them by default
             store_id (int): The store_id of the desired store
 
         Returns:
             tuple: Contains the store info or an error code/message
         """
-        store = StoreModel.query.get_or_404(store_id)
-        return store
+        schema = sparse_schema(StoreSchema, args)
+        store = load_one(store_session(store_id), StoreModel, store_id, schema)
+        return jsonify(schema.dump(store))
 
 
     @jwt_required
@@ -49,9 +57,13 @@ class Store(MethodView):
         if not jwt.get("is_admin"):
             abort(401, message="Admin privileges required.")
 
-        store = StoreModel.query.get_or_404(store_id)
-        db.session.delete(store)
-        db.session.commit()
+        session = store_session(store_id)
+        store = get_or_404(session, StoreModel, store_id)
+        # The store's items are deleted along with it, the one event covers them too
+        record_event(session, "deleted", store)
+        session.delete(store)
+        session.commit()
+        release_ids(store_id=store_id)
         return {"message": "Store deleted."}
 
 @blp.route("/store")
@@ -62,14 +74,21 @@ class StoreList(MethodView):
         MethodView (_type_): _description_
     """
 
+    @blp.arguments(FieldsArgsSchema, location="query")
     @blp.response(200, StoreSchema(many=True))
-    def get(self):
+    def get(self, args: dict):
         """Performs GET request to retrieve all stores
+
+        Args:
+            args (dict): The fields to return, all of them by default
         
         Returns:
             dict: A dictionary containing a list of all stores
         """
-        return StoreModel.query.all()
+        schema = sparse_schema(StoreSchema, args, many=True)
+        options = load_options(StoreModel, schema)
+        rows = iter_rows(StoreModel, lambda session: session.query(StoreModel).options(*options))
+        return stream_json_array(rows, schema)
 
     # TODO: Add description to 200 response code annotation
     @jwt_required()
@@ -87,14 +106,46 @@ class StoreList(MethodView):
         if not jwt.get("is_admin"):
             abort(401, message="Admin privilege required.")
 
-        store = StoreModel(**store_data)
+        try:
+            # Each shard only sees its own stores, so with sharding the name is reserved in the
+            # directory along with the id
+            store_id = allocate_id(StoreModel, name=store_data["name"])
+        except IntegrityError:
+            abort(400, "A store with that name already exists.")
+
+        store = StoreModel(id=store_id, **store_data)
+        session = store_session(store.id)
 
         try:
-            db.session.add(store)
-            db.session.commit()
+            session.add(store)
+            session.flush()
+            record_event(session, "created", store)
+            session.commit()
         except IntegrityError:
+            release_ids(ident=store_id)
             abort(400, "A store with that name already exists.")
-        except SQLAlchemyError:
+        except (SQLAlchemyError, DeadlineExceeded) as error:
+            release_ids(ident=store_id)
+            raise_if_timed_out(error)
             abort(500, message="An error occurred creating the store.")
 
         return store
+
+
+@blp.route("/store/batch")
+class StoreBatch(MethodView):
+    """ Class used to handle HTTP requests for the /store/batch endpoint """
+
+    @blp.arguments(BatchArgsSchema, location="query")
+    @blp.response(200, StoreBatchSchema)
+    def get(self, args: dict) -> dict:
+        """ GET request that retrieves several stores with one query
+
+        Args:
+            args (dict): The ids of the stores to retrieve and, optionally, the fields to return
+
+        Returns:
+            dict: The stores found, in the order of ids, and the ids that weren't found
+        """
+        schema = sparse_schema(StoreSchema, args, many=True)
+        return jsonify(load_batch(StoreModel, schema, args["ids"]))
@@ -1,23 +1,71 @@
+import sys
+
+from flask import jsonify
 from flask.views import MethodView
 from flask_smorest import Blueprint, abort
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import bindparam, select
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from flask_jwt_extended import jwt_required, get_jwt
 
-from db import db
 from models import TagModel, StoreModel, ItemModel
-from schemas import TagSchema, TagAndItemSchema
+from schemas import (TagSchema, PlainTagSchema, TagAndItemSchema, FieldsArgsSchema,
+                     BatchArgsSchema, TagBatchSchema, TagAutocompleteArgsSchema)
+from loading import sparse_schema, load_options, load_one, load_batch
+from entity_cache import cached_get_or_404
+from sharding import session_for, store_session, get_or_404, allocate_id, release_ids
+from group_commit import run_write
+from events import record_event
+from deadlines import DeadlineExceeded, raise_if_timed_out
 
 blp = Blueprint("Tags", "tags", description="Operations on tags")
 
+# A range scan of the (store_id, name) index, built once and reused for every lookup. The
+# open ended one serves the prefixes no name can sort past
+_TAGS_FROM = (
+    select(TagModel.id, TagModel.name)
+    .where(TagModel.store_id == bindparam("store_id"), TagModel.name >= bindparam("start"))
+    .order_by(TagModel.name)
+    .limit(bindparam("limit"))
+)
+_TAGS_BY_PREFIX = _TAGS_FROM.where(TagModel.name < bindparam("end"))
+
+
+def prefix_range(prefix: str) -> tuple:
+    """ Returns the bounds of the names starting with prefix, so the lookup is a range scan
+        instead of a LIKE that SQLite can't serve from the index
+
+    Args:
+        prefix (str): The start of the tag names
+
+    Returns:
+        tuple: The lowest matching name and the first name past the matches, None when every
+            name from the lowest one on matches
+    """
+    # A name past the matches must differ in the last character that can still be raised
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return prefix, None
+
+    following = ord(stem[-1]) + 1
+    # Surrogates can't be stored, the next character after them is the end of the range
+    if 0xD800 <= following <= 0xDFFF:
+        following = 0xE000
+    return prefix, stem[:-1] + chr(following)
+
 @blp.route("/store/<int:store_id>/tag")
 class TagsInStore(MethodView):
     """ Class that handles endpoints for the tags of specific stores """
 
+    @blp.arguments(FieldsArgsSchema, location="query")
     @blp.response(200, TagSchema(many=True))
-    def get(self, store_id: int):
-        store = StoreModel.query.get_or_404(store_id)
+    def get(self, args: dict, store_id: int):
+        schema = sparse_schema(TagSchema, args, many=True)
+        session = store_session(store_id)
+        cached_get_or_404(session, StoreModel, store_id)
 
-        return store.tags.all()
+        tags = session.query(TagModel).filter(TagModel.store_id == store_id)
+        tags = tags.options(*load_options(TagModel, schema)).order_by(TagModel.name).all()
+        return jsonify(schema.dump(tags))
 
     # TODO: Add description to the blp response 201 object
     @jwt_required()
@@ -29,15 +77,56 @@ class TagsInStore(MethodView):
         if not jwt.get("is_admin"):
             abort(401, message="Admin privileges required.")
 
-        tag = TagModel(**tag_data, store_id=store_id)
+        session = store_session(store_id)
+        cached_get_or_404(session, StoreModel, store_id)
+        tag_id = allocate_id(TagModel, store_id)
+
+        def write(writer):
+            tag = TagModel(id=tag_id, **tag_data, store_id=store_id)
+            writer.add(tag)
+            writer.flush()
+            record_event(writer, "created", tag)
+            return tag.id
 
         try:
-            db.session.add(tag)
-            db.session.commit()
-        except SQLAlchemyError as error:
+            tag_id = run_write(session, write)
+        except IntegrityError:
+            release_ids(ident=tag_id)
+            abort(400, message="A tag with that name already exists in the store.")
+        except (SQLAlchemyError, DeadlineExceeded) as error:
+            release_ids(ident=tag_id)
+            raise_if_timed_out(error)
             abort(500, message=str(error))
 
-        return tag
+        return session.get(TagModel, tag_id)
+
+
+@blp.route("/store/<int:store_id>/tag/autocomplete")
+class TagAutocomplete(MethodView):
+    """ Class that handles the tag name autocomplete of specific stores """
+
+    @blp.arguments(TagAutocompleteArgsSchema, location="query")
+    @blp.response(200, PlainTagSchema(many=True))
+    def get(self, args: dict, store_id: int):
+        """ GET request that returns the store's tags whose name starts with prefix
+
+        Args:
+            args (dict): The prefix to complete and the most tags to return
+            store_id (int): The store whose tags are searched
+
+        Returns:
+            list: The matching tags, ordered by name
+        """
+        session = store_session(store_id)
+        cached_get_or_404(session, StoreModel, store_id)
+
+        start, end = prefix_range(args["prefix"])
+        parameters = {"store_id": store_id, "start": start, "limit": args["limit"]}
+        if end is None:
+            rows = session.execute(_TAGS_FROM, parameters)
+        else:
+            rows = session.execute(_TAGS_BY_PREFIX, {**parameters, "end": end})
+        return jsonify([{"id": tag_id, "name": name} for tag_id, name in rows])
 
 
 @blp.route("/item/<int:item_id>/tag/<int:tag_id>")
@@ -53,15 +142,21 @@ class LinkTagsToItem(MethodView):
         if not jwt.get("is_admin"):
             abort(401, message="Admin privileges required.")
 
-        item = ItemModel.query.get_or_404(item_id)
-        tag = TagModel.query.get_or_404(tag_id)
+        # A store's tags live on the same shard as its items, so the tag is looked up there
+        session = session_for(ItemModel, item_id)
+        cached_get_or_404(session, ItemModel, item_id)
+        tag = get_or_404(session, TagModel, tag_id)
 
-        item.tags.append(tag)
+        def write(writer):
+            item = writer.get(ItemModel, item_id)
+            item.tags.append(writer.get(TagModel, tag_id))
+            writer.add(item)
+            record_event(writer, "tagged", item, tag_id=tag_id)
 
         try:
-            db.session.add(item)
-            db.session.commit()
-        except SQLAlchemyError:
+            run_write(session, write)
+        except SQLAlchemyError as error:
+            raise_if_timed_out(error)
             abort(500, message="An error occurred while inserting the tag.")
 
         return tag
@@ -75,14 +170,17 @@ class LinkTagsToItem(MethodView):
         if not jwt.get("is_admin"):
             abort(401, message="Admin privileges required.")
 
-        item = ItemModel.query.get_or_404(item_id)
-        tag = TagModel.query.get_or_404(tag_id)
+        session = session_for(ItemModel, item_id)
+        item = get_or_404(session, ItemModel, item_id)
+        tag = get_or_404(session, TagModel, tag_id)
         item.tags.remove(tag)
 
         try:
-            db.session.add(item)
-            db.session.commit()
-        except SQLAlchemyError:
+            session.add(item)
+            record_event(session, "untagged", item, tag_id=tag_id)
+            session.commit()
+        except SQLAlchemyError as error:
+            raise_if_timed_out(error)
             abort(500, message="An error occurred while removing the tag.")
 
         return {"message": "Item removed from tag", "item": item, "tag": tag}
@@ -92,10 +190,12 @@ class Tag(MethodView):
     """ Class to handle endpoints for creating actual tags """
 
     # TODO: Add description to 200 response code annotation
+    @blp.arguments(FieldsArgsSchema, location="query")
     @blp.response(200, TagSchema)
-    def get(self, tag_id: int):
-        tag = TagModel.query.get_or_404(tag_id)
-        return tag
+    def get(self, args: dict, tag_id: int):
+        schema = sparse_schema(TagSchema, args)
+        tag = load_one(session_for(TagModel, tag_id), TagModel, tag_id, schema)
+        return jsonify(schema.dump(tag))
 
     @jwt_required()
     @blp.response(202, description="Deletes a tag if no item is tagged with it.",
@@ -109,13 +209,35 @@ class Tag(MethodView):
         if not jwt.get("is_admin"):
             abort(401, message="Admin privileges required.")
 
-        tag = TagModel.query.get_or_404(tag_id)
+        session = session_for(TagModel, tag_id)
+        tag = get_or_404(session, TagModel, tag_id)
 
         # Checks if the items list associated with this tag is empty
         if not tag.items:
-            db.session.delete(tag)
-            db.session.commit()
+            record_event(session, "deleted", tag)
+            session.delete(tag)
+            session.commit()
+            release_ids(ident=tag_id)
             return {"message": "Tag deleted."}
 
         abort(400, message="Could not delete tag. Make sure tag is not associated" +
             "with any items, then try again.")
+
+
+@blp.route("/tag/batch")
+class TagBatch(MethodView):
+    """ Class used to handle HTTP requests for the /tag/batch endpoint """
+
+    @blp.arguments(BatchArgsSchema, location="query")
+    @blp.response(200, TagBatchSchema)
+    def get(self, args: dict) -> dict:
+        """ GET request that retrieves several tags with one query
+
+        Args:
+            args (dict): The ids of the tags to retrieve and, optionally, the fields to return
+
+        Returns:
+            dict: The tags found, in the order of ids, and the ids that weren't found
+        """
+        schema = sparse_schema(TagSchema, args, many=True)
+        return jsonify(load_batch(TagModel, schema, args["ids"]))
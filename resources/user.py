@@ -1,18 +1,39 @@
 """ File containing Blueprint and HTTP request handlers for User model """
 
+from flask import jsonify
 from flask.views import MethodView
 from flask_smorest import Blueprint, abort
 from passlib.hash import pbkdf2_sha256
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt, create_refresh_token, get_jwt_identity
+from sqlalchemy import bindparam, select
 
 from db import db
 from models import UserModel
-from schemas import UserSchema
+from schemas import UserSchema, BatchArgsSchema, UserBatchSchema
+from loading import sparse_schema, load_batch
+from entity_cache import cached_get_or_404
 from blocklist import BLOCKLIST
 
 
 blp = Blueprint("Users", "users", description="Operations on users.")
 
+
+# Built once, so /login and /register reuse the compiled statement instead of rebuilding it
+_USER_BY_USERNAME = select(UserModel).where(UserModel.username == bindparam("username")).limit(1)
+
+
+def find_user(username: str) -> UserModel:
+    """ Looks a user up by username
+
+    Args:
+        username (str): The username to look for
+
+    Returns:
+        UserModel: The user, or None if there's no user with that username
+    """
+    return db.session.execute(_USER_BY_USERNAME, {"username": username}).scalars().first()
+
+
 @blp.route("/register")
 class UserRegister(MethodView):
     """ Class used to handle HTTP requests for the /register endpoint
@@ -32,7 +53,7 @@ class UserRegister(MethodView):
             int: The status code of the response
         """
 
-        if UserModel.query.filter(UserModel.username == user_data["username"]).first():
+        if find_user(user_data["username"]):
             abort(409, message="A user with that username already exists.")
 
         user = UserModel(
@@ -64,7 +85,7 @@ class User(MethodView):
             given ID
         """
 
-        user = UserModel.query.get_or_404(user_id)
+        user = cached_get_or_404(db.session, UserModel, user_id)
         return user
 
     @jwt_required()
@@ -93,6 +114,25 @@ class User(MethodView):
         return { "message": "User deleted." }, 200
 
 
+@blp.route("/user/batch")
+class UserBatch(MethodView):
+    """ Class used to handle HTTP requests for the /user/batch endpoint """
+
+    @blp.arguments(BatchArgsSchema, location="query")
+    @blp.response(200, UserBatchSchema)
+    def get(self, args: dict) -> dict:
+        """ GET request that retrieves several users with one query
+
+        Args:
+            args (dict): The ids of the users to retrieve and, optionally, the fields to return
+
+        Returns:
+            dict: The users found, in the order of ids, and the ids that weren't found
+        """
+        schema = sparse_schema(UserSchema, args, many=True)
+        return jsonify(load_batch(UserModel, schema, args["ids"]))
+
+
 @blp.route("/login")
 class UserLogin(MethodView):
     """ Class used to handle HTTP requests for the /login endpoint """
@@ -108,9 +148,7 @@ class UserLogin(MethodView):
             dict: A dictionary containing the user's access token and refresh token
         """
 
-        user = UserModel.query.filter(
-            UserModel.username == user_data["username"]
-        ).first()
+        user = find_user(user_data["username"])
 
         if user and pbkdf2_sha256.verify(user_data["password"], user.password):
             access_token = create_access_token(identity=user.id, fresh=True)
@@ -127,8 +165,8 @@ class TokenRefresh(MethodView):
         " POST request to refresh the user's access token "
         current_user = get_jwt_identity()
         new_token = create_access_token(identity=current_user, fresh=False)
-        jti = get_jwt()["jti"]
-        BLOCKLIST.add(jti)
+        jwt = get_jwt()
+        BLOCKLIST.add(jwt["jti"], jwt["exp"])
         return { "access_token": new_token }
 
 @blp.route("/logout")
@@ -142,6 +180,6 @@ class UserLogout(MethodView):
         Returns:
             JSON object containing a message that the user has logged out
         """
-        jti = get_jwt()["jti"]
-        BLOCKLIST.add(jti)
+        jwt = get_jwt()
+        BLOCKLIST.add(jwt["jti"], jwt["exp"])
         return {"message": "Successfully logged out."}
@@ -1,6 +1,7 @@
 """ File containing each of the schemas used in the API calls to serialize data """
 
-from marshmallow import Schema, fields
+from marshmallow import Schema, fields, validate
+from webargs.fields import DelimitedList
 
 class PlainItemSchema(Schema):
     """Item schema that's used only for representing an item with no relationship to a store
@@ -84,3 +85,109 @@ class UserSchema(Schema):
     id = fields.Int(dump_only=True)
     username = fields.Str(required=True)
     password = fields.Str(required=True, load_only=True)
+
+
+class FieldsArgsSchema(Schema):
+    """ Query string argument used to only return some fields, e.g. ?fields=id,name """
+    fields = DelimitedList(fields.Str())
+
+
+class BatchArgsSchema(FieldsArgsSchema):
+    """ Query string arguments used to look up several rows at once, e.g. ?ids=1,2,3 """
+    ids = DelimitedList(fields.Int(), required=True)
+
+
+class PriceHistoryArgsSchema(Schema):
+    """ Query string arguments used to pick the time range and bucket size of a price history.
+        Times are epoch seconds and the range includes start but not end
+    """
+    start = fields.Int(load_default=0)
+    end = fields.Int()
+    bucket = fields.Int(load_default=3600, validate=validate.Range(min=1))
+
+
+class PriceBucketSchema(Schema):
+    """ Schema that represents the downsampled prices of one bucket of a price history """
+    bucket_start = fields.Int()
+    min = fields.Float()
+    max = fields.Float()
+    avg = fields.Float()
+    count = fields.Int()
+
+
+class EventStreamArgsSchema(Schema):
+    """ Query string argument used to resume the event stream, e.g. ?after=main:15 """
+    after = fields.Str()
+
+
+class ItemBulkResultSchema(Schema):
+    """ Schema that represents the outcome of a bulk item import """
+    created = fields.Int()
+
+
+class ItemBatchSchema(Schema):
+    """ Schema that represents the items found by a batch lookup and the ids that weren't """
+    results = fields.List(fields.Nested(ItemSchema))
+    missing = fields.List(fields.Int())
+
+
+class StoreBatchSchema(Schema):
+    """ Schema that represents the stores found by a batch lookup and the ids that weren't """
+    results = fields.List(fields.Nested(StoreSchema))
+    missing = fields.List(fields.Int())
+
+
+class TagBatchSchema(Schema):
+    """ Schema that represents the tags found by a batch lookup and the ids that weren't """
+    results = fields.List(fields.Nested(TagSchema))
+    missing = fields.List(fields.Int())
+
+
+class UserBatchSchema(Schema):
+    """ Schema that represents the users found by a batch lookup and the ids that weren't """
+    results = fields.List(fields.Nested(UserSchema))
+    missing = fields.List(fields.Int())
+
+
+class HistogramBucketSchema(Schema):
+    """ Schema that represents one price range of a store's price histogram """
+    bucket_start = fields.Float()
+    bucket_end = fields.Float()
+    count = fields.Int()
+
+
+class PriceStatsSchema(Schema):
+    """ Schema that represents the price distribution of a store's items """
+    store_id = fields.Int()
+    item_count = fields.Int()
+    price_min = fields.Float()
+    price_max = fields.Float()
+    price_avg = fields.Float()
+    p50 = fields.Float()
+    p90 = fields.Float()
+    p99 = fields.Float()
+    histogram = fields.List(fields.Nested(HistogramBucketSchema()))
+
+
+class TagPairSchema(Schema):
+    """ Schema that represents how many of a store's items have both of two tags """
+    store_id = fields.Int()
+    tag_a = fields.Int()
+    tag_b = fields.Int()
+    item_count = fields.Int()
+
+
+class TagPairArgsSchema(Schema):
+    """ Query string argument used to limit the tag co-occurrence report """
+    limit = fields.Int(load_default=20, validate=validate.Range(min=1, max=1000))
+
+
+class TagAutocompleteArgsSchema(Schema):
+    """ Query string arguments used to look up a store's tags by the start of their name """
+    prefix = fields.Str(load_default="", validate=validate.Length(max=80))
+    limit = fields.Int(load_default=10, validate=validate.Range(min=1, max=100))
+
+
+class AnalyticsRefreshArgsSchema(Schema):
+    """ Query string argument used to rebuild every summary instead of the changed ones """
+    full = fields.Bool(load_default=False)
@@ -0,0 +1,226 @@
+"""
+This file contains the seeded database snapshots used for integration and performance runs.
+A catalog is built once with bulk Core inserts into an in-memory SQLite database, and every
+run gets its own copy of it through the SQLite backup API (or a file copy), which takes
+milliseconds instead of the minutes that migrations and ORM inserts would
+"""
+
+import os
+import random
+import shutil
+import sqlite3
+import threading
+import time
+from itertools import count
+
+import click
+from alembic.script import ScriptDirectory
+from passlib.hash import pbkdf2_sha256
+from sqlalchemy import create_engine, insert
+from sqlalchemy.pool import StaticPool
+
+from db import db
+from models import ItemModel, ItemPriceModel, ItemTags, StoreModel, TagModel, UserModel
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Rows sent per executemany call
+CHUNK_SIZE = 10000
+
+
+def _insert(connection, model, rows):
+    for start in range(0, len(rows), CHUNK_SIZE):
+        connection.execute(insert(model.__table__), rows[start:start + CHUNK_SIZE])
+
+
+class SeedSnapshot:
+    """ An in-memory SQLite image of a seeded catalog that can be cloned cheaply
+
+    Args:
+        items (int, optional): Number of items, spread evenly over the stores
+        stores (int, optional): Number of stores
+        tags_per_store (int, optional): Number of tags each store has
+        tags_per_item (int, optional): Number of its store's tags each item is linked to
+        users (int, optional): Number of users, user 1 is the admin. Every password is "password"
+        seed (int, optional): Seed of the random prices and tag links
+    """
+
+    def __init__(self, items: int = 100000, stores: int = 100, tags_per_store: int = 20,
+                 tags_per_item: int = 2, users: int = 10, seed: int = 0):
+        self.items = items
+        self.stores = stores
+        self.tags_per_store = tags_per_store
+        self.tags_per_item = min(tags_per_item, tags_per_store)
+        self.users = users
+        self.seed = seed
+        self._image = None
+        self._clones = {}
+        self._names = count(1)
+        self._lock = threading.Lock()
+
+    def build(self) -> sqlite3.Connection:
+        """ Builds the seeded image the first time it's needed
+
+        Returns:
+            sqlite3.Connection: The connection holding the in-memory image
+        """
+        with self._lock:
+            if self._image is None:
+                image = sqlite3.connect(":memory:", check_same_thread=False)
+                engine = create_engine("sqlite://", creator=lambda: image, poolclass=StaticPool)
+                db.metadata.create_all(engine)
+                with engine.begin() as connection:
+                    self._populate(connection)
+                image.execute("ANALYZE")
+                self._image = image
+
+        return self._image
+
+    def _populate(self, connection):
+        rng = random.Random(self.seed)
+        now = int(time.time())
+        password = pbkdf2_sha256.hash("password")
+
+        _insert(connection, UserModel, [
+            {"id": user_id, "username": f"user{user_id}", "password": password}
+            for user_id in range(1, self.users + 1)
+        ])
+        _insert(connection, StoreModel, [
+            {"id": store_id, "name": f"store{store_id}"} for store_id in range(1, self.stores + 1)
+        ])
+        _insert(connection, TagModel, [
+            {"id": (store_id - 1) * self.tags_per_store + number, "store_id": store_id,
+             "name": f"store{store_id}-tag{number}"}
+            for store_id in range(1, self.stores + 1)
+            for number in range(1, self.tags_per_store + 1)
+        ])
+
+        items, prices, links = [], [], []
+        for item_id in range(1, self.items + 1):
+            store_id = (item_id - 1) % self.stores + 1
+            price = round(rng.uniform(1, 500), 2)
+            items.append({"id": item_id, "name": f"item{item_id}", "price": price,
+                          "store_id": store_id})
+            prices.append({"item_id": item_id, "store_id": store_id, "price": price,
+                           "recorded_at": now})
+            first_tag = (store_id - 1) * self.tags_per_store + 1
+            links.extend({"item_id": item_id, "tag_id": first_tag + number} for number in
+                         rng.sample(range(self.tags_per_store), self.tags_per_item))
+
+        _insert(connection, ItemModel, items)
+        _insert(connection, ItemPriceModel, prices)
+        _insert(connection, ItemTags, links)
+
+        # Stamped with the latest revision so "flask db upgrade" leaves the copy alone
+        head = ScriptDirectory(MIGRATIONS_DIR).get_current_head()
+        connection.exec_driver_sql("CREATE TABLE alembic_version "
+                                   "(version_num VARCHAR(32) NOT NULL PRIMARY KEY)")
+        connection.exec_driver_sql("INSERT INTO alembic_version VALUES (?)", (head,))
+
+    def save(self, path: str):
+        """ Writes the image to a SQLite file, replacing it if it exists
+
+        Args:
+            path (str): The file to write
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        target = sqlite3.connect(path)
+        try:
+            self.build().backup(target)
+        finally:
+            target.close()
+
+    def clone(self, path: str = None) -> str:
+        """ Makes a private copy of the image
+
+        Args:
+            path (str, optional): Copy to this file instead of to a new in-memory database
+
+        Returns:
+            str: The database URL of the copy, e.g. to pass to create_app
+        """
+        if path is not None:
+            self.save(path)
+            return f"sqlite:///{os.path.abspath(path)}"
+
+        # A named shared-cache database lives as long as one connection to it is open. The name
+        # is absolute so Flask-SQLAlchemy doesn't move it under the app's instance folder
+        name = f"/seed_{id(self)}_{next(self._names)}"
+        keeper = sqlite3.connect(f"file:{name}?mode=memory&cache=shared", uri=True,
+                                 check_same_thread=False)
+        self.build().backup(keeper)
+
+        # Connections are made per thread, dispose_app closes the background threads' ones too
+        url = f"sqlite:///file:{name}?mode=memory&cache=shared&uri=true&check_same_thread=false"
+        self._clones[url] = keeper
+        return url
+
+    def drop(self, url: str, app=None):
+        """ Frees an in-memory copy made by clone
+
+        Args:
+            url (str): The URL clone returned
+            app (Flask, optional): The app serving the copy, its threads and connections would
+                otherwise keep the copy alive
+        """
+        if app is not None:
+            # Imported here, app imports this module for its seed command
+            from app import dispose_app
+            dispose_app(app)
+
+        keeper = self._clones.pop(url, None)
+        if keeper is not None:
+            keeper.close()
+
+
+def copy_database(source: str, target: str):
+    """ Copies a seeded SQLite file. On copy-on-write filesystems (btrfs, XFS) the copy shares
+        the source's blocks, so it's made in constant time
+
+    Args:
+        source (str): A file written by SeedSnapshot.save
+        target (str): The file to create
+    """
+    with open(source, "rb") as source_file, open(target, "wb") as target_file:
+        try:
+            remaining = os.fstat(source_file.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(source_file.fileno(), target_file.fileno(), remaining)
+                if not copied:
+                    break
+                remaining -= copied
+            return
+        except (AttributeError, OSError):
+            pass
+
+    shutil.copyfile(source, target)
+
+
+_snapshots = {}
+
+
+def get_snapshot(**params) -> SeedSnapshot:
+    """ Returns the process-wide snapshot for the given SeedSnapshot arguments, so every run
+        with the same parameters shares one image
+
+    Returns:
+        SeedSnapshot: The snapshot, built on first use
+    """
+    key = tuple(sorted(params.items()))
+    if key not in _snapshots:
+        _snapshots[key] = SeedSnapshot(**params)
+    return _snapshots[key]
+
+
+@click.command("seed")
+@click.option("--output", default="seed.db", show_default=True, help="SQLite file to write.")
+@click.option("--items", default=100000, show_default=True)
+@click.option("--stores", default=100, show_default=True)
+@click.option("--users", default=10, show_default=True)
+def seed_command(output: str, items: int, stores: int, users: int):
+    """ Writes a seeded catalog to a SQLite file """
+    started = time.perf_counter()
+    SeedSnapshot(items=items, stores=stores, users=users).save(output)
+    click.echo(f"Wrote {items} items in {stores} stores to {output} "
+               f"in {time.perf_counter() - started:.1f}s.")
@@ -0,0 +1,490 @@
+"""
+This file contains the shard router that spreads stores (and the items, tags and item tags that
+belong to them) across several databases. Sharding is turned on by listing the shard database
+URLs in SHARD_DATABASE_URLS, and when it's off every helper falls back to db.session.
+
+Reads and list queries spread over the shards, but creates don't: every new store, item and tag
+first records its id (and, for stores and items, its name) in the shard_keys directory of the
+main database, which routes lookups by id and keeps names unique across shards. Each create is
+a commit on the main database followed by one on its shard, so create throughput is bounded by
+the main database whatever the number of shards. Group commit shares the directory commits of
+concurrent requests, and bulk imports reserve a whole batch in one
+"""
+
+import bisect
+import hashlib
+import heapq
+import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures import wait as futures_wait
+
+from alembic.autogenerate import produce_migrations
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from alembic.script import ScriptDirectory
+from flask import current_app, g
+from flask_smorest import abort
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from db import db
+from deadlines import DeadlineExceeded, no_deadline, remaining, with_deadline
+from group_commit import run_write
+from models import ShardKeyModel, StoreModel
+
+# Tables that live on the shards, everything else (users, shard_keys) stays on the main database
+SHARDED_TABLES = ("stores", "items", "tags", "items_tags", "item_prices", "outbox_events",
+                  "store_price_stats", "price_histogram", "tag_pairs", "analytics_cursor")
+
+# Kinds of rows whose names must be unique across every shard, they're reserved in the directory
+UNIQUE_NAME_KINDS = ("stores", "items")
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def _stamp_head(connection):
+    MigrationContext.configure(connection).stamp(ScriptDirectory(MIGRATIONS_DIR), "head")
+
+
+def create_shard_schema(engine):
+    """ Creates the schema of a new, empty shard: every table, like the main database (only the
+        sharded ones get rows), stamped with the latest migration so "flask db upgrade"
+        migrates it from there. Shards that already have tables are left alone
+
+    Args:
+        engine (Engine): The shard's engine
+    """
+    with engine.begin() as connection:
+        if inspect(connection).get_table_names():
+            return
+        db.metadata.create_all(connection)
+        _stamp_head(connection)
+
+
+def adopt_legacy_shard(connection):
+    """ Brings a shard created before shards were migrated up to the current models and stamps
+        it with the latest migration. Those shards were made with create_all, so each of their
+        tables has the schema the models had when it was created, and the ones that changed
+        since are rebuilt from the models. Shards that are already stamped are left alone
+
+    Args:
+        connection (Connection): A connection to the shard, foreign keys must be off on SQLite
+    """
+    context = MigrationContext.configure(connection, opts={"target_metadata": db.metadata})
+    if context.get_current_revision() is not None or not inspect(connection).get_table_names():
+        return
+
+    db.metadata.create_all(connection)
+    changed = {getattr(op, "table_name", None)
+               for op in produce_migrations(context, db.metadata).upgrade_ops.ops}
+
+    operations = Operations(context)
+    for name in SHARDED_TABLES:
+        if name in changed:
+            with operations.batch_alter_table(name, copy_from=db.metadata.tables[name],
+                                              recreate="always"):
+                pass
+
+    _stamp_head(connection)
+    connection.commit()
+
+
+class HashRing:
+    """ Consistent-hash ring that maps store ids onto shard names, so adding a shard
+        only moves a small share of the stores
+    """
+
+    def __init__(self, shard_names: list, replicas: int = 64):
+        self._ring = sorted(
+            (self._hash(f"{name}#{replica}"), name)
+            for name in shard_names
+            for replica in range(replicas)
+        )
+        self._keys = [key for key, _ in self._ring]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def get(self, store_id: int) -> str:
+        """ Returns the name of the shard that owns the given store
+
+        Args:
+            store_id (int): The id of the store
+
+        Returns:
+            str: The shard name
+        """
+        index = bisect.bisect(self._keys, self._hash(str(store_id))) % len(self._keys)
+        return self._ring[index][1]
+
+
+class ShardRouter:
+    """ Holds one engine per shard and decides which shard a store belongs to """
+
+    def __init__(self, urls: list, replicas: int = 64):
+        self.engines = {f"shard_{index}": create_engine(url) for index, url in enumerate(urls)}
+        self.ring = HashRing(list(self.engines), replicas)
+        self.executor = ThreadPoolExecutor(max_workers=len(self.engines),
+                                           thread_name_prefix="shard")
+
+        for engine in self.engines.values():
+            create_shard_schema(engine)
+
+    def shard_for_store(self, store_id: int) -> str:
+        """ Returns the name of the shard that holds the given store's rows """
+        return self.ring.get(store_id)
+
+    def fan_out(self, func) -> list:
+        """ Runs func against every shard in parallel and merges the lists it returns
+
+        Args:
+            func: Callable taking a Session and returning a list
+
+        Returns:
+            list: The concatenated results of every shard
+        """
+        def run(engine):
+            with Session(engine) as session:
+                return func(session)
+
+        return [row for rows in self.executor.map(with_deadline(run), self.engines.values())
+                for row in rows]
+
+
+def init_sharding(app):
+    """ Creates the shard router if SHARD_DATABASE_URLS is configured
+
+    Args:
+        app (Flask): The application to set sharding up for
+    """
+    urls = app.config.get("SHARD_DATABASE_URLS")
+    if not urls:
+        return
+
+    app.extensions["sharding"] = ShardRouter(urls)
+    app.teardown_appcontext(_close_shard_sessions)
+
+
+def close_sharding(app):
+    """ Stops the shard threads and closes every shard's connections
+
+    Args:
+        app (Flask): The application whose shard router is closed
+    """
+    router = app.extensions.pop("sharding", None)
+    if router is None:
+        return
+
+    router.executor.shutdown()
+    for engine in router.engines.values():
+        engine.dispose()
+
+
+def _router():
+    return current_app.extensions.get("sharding")
+
+
+def _shard_session(router: ShardRouter, shard: str) -> Session:
+    sessions = g.setdefault("shard_sessions", {})
+    if shard not in sessions:
+        sessions[shard] = Session(router.engines[shard])
+    return sessions[shard]
+
+
+def _close_shard_sessions(exc):
+    for session in g.pop("shard_sessions", {}).values():
+        session.close()
+
+
+def store_session(store_id: int) -> Session:
+    """ Returns the session for the shard that holds the given store
+
+    Args:
+        store_id (int): The id of the store
+
+    Returns:
+        Session: The shard's session, or db.session when sharding is off
+    """
+    router = _router()
+    if router is None:
+        return db.session
+
+    if store_id is None:
+        abort(400, message="A store_id is required.")
+
+    return _shard_session(router, router.shard_for_store(store_id))
+
+
+def session_for(model, ident: int):
+    """ Looks up which shard holds the row with the given id
+
+    Args:
+        model: StoreModel, ItemModel or TagModel
+        ident (int): The id of the row
+
+    Returns:
+        Session: The shard's session, db.session when sharding is off, or None if the id is unknown
+    """
+    router = _router()
+    if router is None:
+        return db.session
+
+    if model is StoreModel:
+        return _shard_session(router, router.shard_for_store(ident))
+
+    key = db.session.get(ShardKeyModel, ident)
+    if key is None or key.kind != model.__tablename__:
+        return None
+
+    return _shard_session(router, router.shard_for_store(key.store_id))
+
+
+def sessions_for(model, idents: list) -> dict:
+    """ Groups ids by the shard that holds them, so each shard can be queried once
+
+    Args:
+        model: The model class the ids belong to
+        idents (list): The ids to look up
+
+    Returns:
+        dict: The ids to query per session, ids the directory doesn't know are left out
+    """
+    router = _router()
+    if router is None or model.__tablename__ not in SHARDED_TABLES:
+        return {db.session: list(idents)}
+
+    if model is StoreModel:
+        owners = {ident: ident for ident in idents}
+    else:
+        keys = ShardKeyModel.query.filter(ShardKeyModel.id.in_(idents),
+                                          ShardKeyModel.kind == model.__tablename__)
+        owners = {key.id: key.store_id for key in keys}
+
+    groups = {}
+    for ident, store_id in owners.items():
+        session = _shard_session(router, router.shard_for_store(store_id))
+        groups.setdefault(session, []).append(ident)
+    return groups
+
+
+def get_or_404(session: Session, model, ident: int, options: list = None):
+    """ Sharding-aware version of Model.query.get_or_404
+
+    Args:
+        session (Session): The session returned by session_for or store_session
+        model: The model class to load
+        ident (int): The primary key of the row
+        options (list, optional): Loader options, see loading.load_options
+
+    Returns:
+        The loaded model instance, aborts with a 404 if it doesn't exist
+    """
+    instance = session.get(model, ident, options=options) if session is not None else None
+    if instance is None:
+        abort(404)
+    return instance
+
+
+def allocate_ids(model, store_id: int = None, names: list = None, idents: list = None) -> list:
+    """ Reserves a block of ids in the shard directory with a single transaction, so they're
+        unique across every shard. The names of stores and items are reserved with them, which
+        keeps those unique across shards too. Under group commit the directory writes of
+        concurrent requests share a transaction of the main database as well
+
+    Args:
+        model: The model class the ids are for
+        store_id (int, optional): The store that will own the rows. Stores own themselves
+        names (list, optional): The name of each row, only kept for stores and items
+        idents (list, optional): Specific ids to reserve instead of the next free ones
+
+    Returns:
+        list: The reserved ids, or idents (Nones by default) when sharding is off. Raises an
+            IntegrityError when one of the ids or names is already taken
+    """
+    kind = model.__tablename__
+    count = len(names) if names is not None else len(idents)
+    idents = idents if idents is not None else [None] * count
+    if _router() is None:
+        return idents
+
+    names = names if kind in UNIQUE_NAME_KINDS and names is not None else [None] * count
+
+    def write(writer):
+        keys = [ShardKeyModel(id=ident, kind=kind, store_id=store_id, name=name)
+                for ident, name in zip(idents, names)]
+        writer.add_all(keys)
+        writer.flush()
+        for key in keys:
+            if key.store_id is None:
+                key.store_id = key.id
+        return [key.id for key in keys]
+
+    try:
+        return run_write(db.session, write)
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+
+
+def allocate_id(model, store_id: int = None, ident: int = None, name: str = None):
+    """ Reserves one id in the shard directory, see allocate_ids
+
+    Args:
+        model: The model class the id is for
+        store_id (int, optional): The store that will own the row. Stores own themselves
+        ident (int, optional): A specific id to reserve instead of the next free one
+        name (str, optional): The name of the row, only kept for stores and items
+
+    Returns:
+        int: The reserved id, or ident (None by default) when sharding is off
+    """
+    return allocate_ids(model, store_id, [name], [ident])[0]
+
+
+def rename_id(model, ident: int, name: str):
+    """ Moves the name reserved in the shard directory for a store or an item
+
+    Args:
+        model: The model class of the row
+        ident (int): The id of the row
+        name (str): The row's new name
+
+    Returns:
+        str: The name that was reserved before, None when sharding is off or nothing changed.
+            Raises an IntegrityError when the new name is already taken
+    """
+    if _router() is None or model.__tablename__ not in UNIQUE_NAME_KINDS or name is None:
+        return None
+
+    key = db.session.get(ShardKeyModel, ident)
+    if key is None or key.name == name:
+        return None
+
+    previous = key.name
+    key.name = name
+    try:
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+
+    return previous
+
+
+def release_ids(ident: int = None, store_id: int = None, idents: list = None):
+    """ Removes deleted rows, or rows whose insert failed, from the shard directory
+
+    Args:
+        ident (int, optional): The id of a single deleted item or tag
+        store_id (int, optional): The id of a deleted store, releases everything it owned
+        idents (list, optional): The ids of several rows
+    """
+    if _router() is None:
+        return
+
+    query = ShardKeyModel.query
+    if store_id is not None:
+        query = query.filter(ShardKeyModel.store_id == store_id)
+    elif idents is not None:
+        query = query.filter(ShardKeyModel.id.in_(idents))
+    else:
+        query = query.filter(ShardKeyModel.id == ident)
+
+    # Also called once a request ran out of time, the ids must be released all the same
+    with no_deadline():
+        query.delete()
+        db.session.commit()
+
+
+def fan_out(func, schema=None, order_by: str = "id") -> list:
+    """ Runs a list query against every shard in parallel and merges the results by id
+
+    Args:
+        func: Callable taking a Session and returning a list of model instances
+        schema (optional): The schema (many=True) used to serialize each shard's rows,
+            without one the lists func returns are merged as they are
+        order_by (str, optional): The key the merged rows are sorted by, None keeps shard order
+
+    Returns:
+        list: The serialized rows from every shard
+    """
+    def run(session):
+        rows = func(session)
+        return schema.dump(rows) if schema is not None else rows
+
+    router = _router()
+    if router is None:
+        return run(db.session)
+
+    rows = router.fan_out(run)
+    return sorted(rows, key=lambda row: row[order_by]) if order_by else rows
+
+
+def iter_rows(model, func, batch_size: int = 500):
+    """ Lazily iterates over the rows of a list query on every shard, merged by id. Rows are
+        read batch_size at a time with keyset pagination, so no batch holds a cursor (and the
+        database's read lock) open while the previous one is being sent. With sharding on,
+        every shard's first page is read in parallel right away, and each shard's next page
+        is read in the background while the current one is being consumed
+
+    Args:
+        model: The model class being queried
+        func: Callable taking a Session and returning a Query of model
+        batch_size (int, optional): How many rows are loaded per query
+
+    Returns:
+        Iterator of model instances ordered by id
+    """
+    def read(session, last_id):
+        query = func(session)
+        if last_id is not None:
+            query = query.filter(model.id > last_id)
+        return query.order_by(model.id).limit(batch_size).all()
+
+    def pages(session):
+        last_id = None
+        while True:
+            rows = read(session, last_id)
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1].id
+
+    router = _router()
+    if router is None:
+        return pages(db.session)
+
+    # Each page gets its own session, the next one is read by a shard thread while the rows
+    # of the current one may still lazy load through theirs
+    def fetch(engine, last_id):
+        session = Session(engine)
+        task = with_deadline(lambda: read(session, last_id))
+        return session, router.executor.submit(task)
+
+    def prefetched(engine, pending):
+        current = None
+        try:
+            while pending is not None:
+                if current is not None:
+                    current[0].close()
+                current, pending = pending, None
+                try:
+                    rows = current[1].result(timeout=remaining())
+                except FutureTimeout:
+                    raise DeadlineExceeded("A shard didn't answer before the request's deadline.")
+                if len(rows) == batch_size:
+                    pending = fetch(engine, rows[-1].id)
+                yield from rows
+        finally:
+            # A page still being read has to finish before its session can be closed
+            for page in (current, pending):
+                if page is not None:
+                    page[1].cancel()
+                    futures_wait([page[1]])
+                    page[0].close()
+
+    return heapq.merge(*(prefetched(engine, fetch(engine, None))
+                         for engine in router.engines.values()),
+                       key=lambda row: row.id)
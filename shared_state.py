@@ -0,0 +1,179 @@
+"""
+This file contains the backends for state every worker has to agree on, like revoked tokens,
+rate limit counters and the request metrics. The memory backend keeps it in the process, which is only right with
+a single worker, and the database backend keeps it in the shared_state table of the main
+database so any number of workers (or containers) see the same values
+"""
+
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import case, delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db import db
+from models import SharedEntryModel
+
+# expires_at of entries that are kept for good, like the metrics counters
+FOREVER = 2 ** 31 - 1
+
+
+class MemoryBackend:
+    """ Shared state kept in this process only """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def add(self, namespace: str, key: str, expires_at: int):
+        """ Records key in namespace until expires_at (epoch seconds) """
+        with self._lock:
+            self._entries[(namespace, key)] = (1, expires_at)
+
+    def contains(self, namespace: str, key: str) -> bool:
+        """ Returns whether key is recorded in namespace and hasn't expired """
+        entry = self._entries.get((namespace, key))
+        return entry is not None and entry[1] > time.time()
+
+    def incr(self, namespace: str, key: str, expires_at: int, amount: int = 1) -> int:
+        """ Adds amount to the counter key of namespace, creating it if needed
+
+        Returns:
+            int: The counter's new value
+        """
+        now = time.time()
+        with self._lock:
+            value, _ = self._entries.get((namespace, key), (0, expires_at))
+            if value == 0:
+                self._purge(now)
+            self._entries[(namespace, key)] = (value + amount, expires_at)
+            return value + amount
+
+    def set_max(self, namespace: str, key: str, value: int, expires_at: int):
+        """ Raises the value of key in namespace to value, creating it if needed """
+        with self._lock:
+            current, _ = self._entries.get((namespace, key), (value, expires_at))
+            self._entries[(namespace, key)] = (max(current, value), expires_at)
+
+    def counters(self, namespace: str) -> dict:
+        """ Returns the value of every unexpired key of namespace """
+        now = time.time()
+        with self._lock:
+            return {key: value for (entry_namespace, key), (value, expires_at)
+                    in self._entries.items() if entry_namespace == namespace and expires_at > now}
+
+    def _purge(self, now: float):
+        expired = [entry for entry, (_, expires_at) in self._entries.items() if expires_at <= now]
+        for entry in expired:
+            del self._entries[entry]
+
+
+class DatabaseBackend:
+    """ Shared state kept in the shared_state table, each call runs in its own short
+        transaction so it's visible to every worker as soon as it returns
+    """
+
+    _inserts = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._insert = self._inserts[engine.dialect.name]
+
+    def add(self, namespace: str, key: str, expires_at: int):
+        """ Records key in namespace until expires_at (epoch seconds) """
+        statement = self._insert(SharedEntryModel.__table__).values(
+            namespace=namespace, key=key, value=1, expires_at=expires_at)
+        statement = statement.on_conflict_do_update(
+            index_elements=["namespace", "key"], set_={"expires_at": expires_at})
+
+        with self.engine.begin() as connection:
+            connection.execute(statement)
+            self._purge(connection)
+
+    def contains(self, namespace: str, key: str) -> bool:
+        """ Returns whether key is recorded in namespace and hasn't expired """
+        table = SharedEntryModel.__table__
+        with self.engine.connect() as connection:
+            expires_at = connection.execute(
+                select(table.c.expires_at)
+                .where(table.c.namespace == namespace, table.c.key == key)
+            ).scalar()
+        return expires_at is not None and expires_at > time.time()
+
+    def incr(self, namespace: str, key: str, expires_at: int, amount: int = 1) -> int:
+        """ Adds amount to the counter key of namespace, creating it if needed
+
+        Returns:
+            int: The counter's new value
+        """
+        table = SharedEntryModel.__table__
+        statement = self._insert(table).values(
+            namespace=namespace, key=key, value=amount, expires_at=expires_at)
+        statement = statement.on_conflict_do_update(
+            index_elements=["namespace", "key"], set_={"value": table.c.value + amount})
+
+        # The upsert locks the row, so reading it back in the same transaction can't see
+        # another worker's increment
+        with self.engine.begin() as connection:
+            connection.execute(statement)
+            value = connection.execute(
+                select(table.c.value).where(table.c.namespace == namespace, table.c.key == key)
+            ).scalar()
+            if value == amount:
+                self._purge(connection)
+
+        return value
+
+    def set_max(self, namespace: str, key: str, value: int, expires_at: int):
+        """ Raises the value of key in namespace to value, creating it if needed """
+        table = SharedEntryModel.__table__
+        statement = self._insert(table).values(
+            namespace=namespace, key=key, value=value, expires_at=expires_at)
+        statement = statement.on_conflict_do_update(
+            index_elements=["namespace", "key"],
+            set_={"value": case((statement.excluded.value > table.c.value,
+                                 statement.excluded.value), else_=table.c.value)})
+
+        with self.engine.begin() as connection:
+            connection.execute(statement)
+
+    def counters(self, namespace: str) -> dict:
+        """ Returns the value of every unexpired key of namespace """
+        table = SharedEntryModel.__table__
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                select(table.c.key, table.c.value)
+                .where(table.c.namespace == namespace, table.c.expires_at > time.time())
+            )
+            return dict(rows.all())
+
+    @staticmethod
+    def _purge(connection):
+        table = SharedEntryModel.__table__
+        connection.execute(delete(table).where(table.c.expires_at <= int(time.time())))
+
+
+def init_shared_state(app):
+    """ Creates the shared state backend named by SHARED_STATE_BACKEND
+
+    Args:
+        app (Flask): The application to create the backend for
+    """
+    backend = app.config["SHARED_STATE_BACKEND"]
+    if backend == "memory":
+        app.extensions["shared_state"] = MemoryBackend()
+    elif backend == "database":
+        with app.app_context():
+            app.extensions["shared_state"] = DatabaseBackend(db.engine)
+    else:
+        raise ValueError(f"Unknown SHARED_STATE_BACKEND {backend!r}.")
+
+
+def get_shared_state():
+    """ Returns the app's shared state backend
+
+    Returns:
+        MemoryBackend or DatabaseBackend: The backend created by init_shared_state
+    """
+    return current_app.extensions["shared_state"]
@@ -0,0 +1,43 @@
+"""
+This file contains the connection setup for SQLite databases (the main one and any shard).
+Every new connection gets the pragmas from SQLITE_PRAGMAS, a bigger page cache and in-memory
+temp tables by default, and a larger sqlite3 statement cache so the handful of statements the
+hot handlers run are parsed once per connection instead of once per request
+"""
+
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Shared by every engine of the process, set by init_sqlite_tuning
+_settings = {"pragmas": {}, "statement_cache_size": 128}
+
+
+def _on_do_connect(dialect, connection_record, cargs, cparams):
+    if dialect.name == "sqlite":
+        cparams.setdefault("cached_statements", _settings["statement_cache_size"])
+
+
+def _on_connect(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+
+    cursor = dbapi_connection.cursor()
+    for name, value in _settings["pragmas"].items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def init_sqlite_tuning(app):
+    """ Registers the SQLite connection setup, it must run before any engine connects
+
+    Args:
+        app (Flask): The application holding SQLITE_PRAGMAS and SQLITE_STATEMENT_CACHE_SIZE
+    """
+    _settings["pragmas"] = dict(app.config["SQLITE_PRAGMAS"])
+    _settings["statement_cache_size"] = app.config["SQLITE_STATEMENT_CACHE_SIZE"]
+
+    if not event.contains(Engine, "connect", _on_connect):
+        event.listen(Engine, "do_connect", _on_do_connect)
+        event.listen(Engine, "connect", _on_connect)